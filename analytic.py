@@ -0,0 +1,152 @@
+"""
+Exact evaluation of a Strategy against an actual bracket.  With a fixed
+favorite_bias and protected_function every pick is a biased coin that only
+depends on which two teams reach a game, so the distribution of scores can be
+computed by propagating probabilities up the bracket instead of sampling it.
+"""
+
+import numpy
+
+from montecarlo import favorite_teams, left_win_probabilities, round_weights
+
+
+class ExactScore:
+    """
+    The exact distribution of a strategy's score against the actual bracket.
+
+    :param pmf: pmf[score] is the probability of scoring exactly that many points
+    :param advancement: advancement[slot, team] is the probability that the
+                        strategy picks the team to win the slot
+    """
+    def __init__(self, pmf, advancement):
+        self.pmf = pmf
+        self.advancement = advancement
+
+    @property
+    def mean(self):
+        return float(numpy.arange(len(self.pmf)) @ self.pmf)
+
+    @property
+    def variance(self):
+        return float(numpy.arange(len(self.pmf)) ** 2 @ self.pmf) - self.mean ** 2
+
+    @property
+    def stdev(self):
+        return max(self.variance, 0.0) ** 0.5
+
+    def percentile(self, percent):
+        """The smallest score that is at least as likely as the percentile"""
+        return float(numpy.searchsorted(numpy.cumsum(self.pmf), percent / 100.0 - 1e-12))
+
+    def __str__(self):
+        return "MEAN: %2.1f\tSTDEV: %2.1f\tP5: %2.1f\tP50: %2.1f\tP95: %2.1f\t(exact)" % (
+            self.mean,
+            self.stdev,
+            self.percentile(5),
+            self.percentile(50),
+            self.percentile(95)
+        )
+
+
+def pick_probabilities(bracket, strategy, round_index, left, right):
+    """
+    The probability that the strategy picks each left team over the right team
+    it is paired with in a round.
+
+    :param left: Array of left (upper) team indices
+    :param right: Array of right (lower) team indices, broadcastable with left
+    """
+    seeds = numpy.asarray(bracket.seeds, dtype=numpy.int16)
+    left, right = numpy.broadcast_arrays(left, right)
+
+    number_protected = 0
+    if strategy.protected_function:
+        number_protected = strategy.protected_function(bracket.round_name(round_index))
+
+    # The favorite wins unless the coin toss lands above the bias (or it is protected)
+    left_favored = favorite_teams(bracket.matchups, left, right, round_index == 1) == left
+    if strategy.model:
+        left_wins = left_win_probabilities(bracket.matchups, strategy.model, left, right, round_index == 1)
+        left_as_favorite = numpy.where(seeds[left] <= number_protected, 1.0, left_wins)
+        right_as_favorite = numpy.where(seeds[right] <= number_protected, 1.0, 1.0 - left_wins)
+    else:
+        favorite_probability = min(max(strategy.favorite_bias, 0.0), 1.0)
+        left_as_favorite = numpy.where(seeds[left] <= number_protected, 1.0, favorite_probability)
+        right_as_favorite = numpy.where(seeds[right] <= number_protected, 1.0, favorite_probability)
+    return numpy.where(left_favored, left_as_favorite, 1.0 - right_as_favorite)
+
+
+def advancement_probabilities(bracket, strategy):
+    """
+    advancement[slot, team] is the probability that the strategy picks the
+    team to win the slot.  The same as ExactScore.advancement, but it only
+    needs the teams, so it also works before any game is played.
+    """
+    advancement = numpy.zeros((bracket.games, bracket.teams))
+    for round_index in range(1, bracket.rounds + 1):
+        round_slice = bracket.round_slice(round_index)
+        subtree_teams = 1 << round_index
+        for position, slot in enumerate(range(round_slice.start, round_slice.stop)):
+            teams = numpy.arange(position * subtree_teams, (position + 1) * subtree_teams)
+            left, right = teams[:subtree_teams // 2], teams[subtree_teams // 2:]
+            if round_index == 1:
+                left_reaches = right_reaches = numpy.ones(1)
+            else:
+                left_reaches = advancement[2 * slot + 1, left]
+                right_reaches = advancement[2 * slot + 2, right]
+
+            left_wins = pick_probabilities(bracket, strategy, round_index, left[:, None], right[None, :])
+            advancement[slot, left] = left_reaches * (left_wins @ right_reaches)
+            advancement[slot, right] = right_reaches * ((1.0 - left_wins).T @ left_reaches)
+    return advancement
+
+
+def evaluate_strategy(actual_bracket, strategy):
+    """
+    Computes the exact score distribution of a strategy against the actual
+    bracket.  Every slot keeps, for each team that can win it, the distribution
+    of points scored inside its subtree given that team wins; a game combines
+    its two subtrees in O(teams^2) per round.
+
+    :return: The ExactScore of the strategy
+    """
+    weights = round_weights(actual_bracket)
+    scores = int(weights.sum()) + 1
+    advancement = numpy.zeros((actual_bracket.games, actual_bracket.teams))
+
+    # distributions[slot][i] is the score distribution of the slot's subtree
+    # given that the i-th team of the subtree wins it
+    distributions = [None] * actual_bracket.games
+    for round_index in range(1, actual_bracket.rounds + 1):
+        round_slice = actual_bracket.round_slice(round_index)
+        subtree_teams = 1 << round_index
+        for position, slot in enumerate(range(round_slice.start, round_slice.stop)):
+            teams = numpy.arange(position * subtree_teams, (position + 1) * subtree_teams)
+            left, right = teams[:subtree_teams // 2], teams[subtree_teams // 2:]
+            if round_index == 1:
+                left_scores = right_scores = numpy.eye(1, scores)
+            else:
+                left_scores = distributions[2 * slot + 1]
+                right_scores = distributions[2 * slot + 2]
+                distributions[2 * slot + 1] = distributions[2 * slot + 2] = None
+
+            left_wins = pick_probabilities(actual_bracket, strategy, round_index, left[:, None], right[None, :])
+            distribution = numpy.empty((subtree_teams, scores))
+            distribution[:len(left)] = _combine(left_scores, left_wins @ right_scores)
+            distribution[len(left):] = _combine(right_scores, (1.0 - left_wins).T @ left_scores)
+
+            actual_winner = actual_bracket.winners[slot] - teams[0]
+            distribution[actual_winner] = numpy.roll(distribution[actual_winner], weights[slot])
+            distributions[slot] = distribution
+            advancement[slot, teams] = distribution.sum(axis=1)
+
+    return ExactScore(distributions[0].sum(axis=0), advancement)
+
+
+def _combine(own_scores, opponent_scores):
+    """Convolves each team's own subtree scores with its mixed opponent scores"""
+    scores = own_scores.shape[1]
+    return numpy.array([
+        numpy.convolve(own, opponent)[:scores]
+        for (own, opponent) in zip(numpy.broadcast_to(own_scores, opponent_scores.shape), opponent_scores)
+    ])
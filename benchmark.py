@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for each phase of a simulation run: parsing the data file, building
+the bracket, copying, predicting, scoring and printing it.  The data comes from
+a synthetic Game By Game file following schema.py, so no external data is
+needed.  Results can be saved as JSON and compared against an earlier run.
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import analytic
+import montecarlo
+import ncaa_simulations
+from schema import Schema
+from strategy import DefaultStrategies
+
+BRACKET_ORDER = [1, 16, 8, 9, 5, 12, 4, 13, 6, 11, 3, 14, 7, 10, 2, 15]
+REGION_ORDER = [Schema.EAST, Schema.WEST, Schema.SOUTH, Schema.MIDWEST]
+RANKED_TEAMS = 25
+DEFAULT_TOLERANCE = 0.2
+
+
+def seed_order(seeds):
+    """
+    The order of seeds down a region with the given number of them (16 or a
+    bigger power of two), where each pair of teams meeting adds up the same.
+    """
+    order = BRACKET_ORDER
+    while len(order) < seeds:
+        order = [seed for top_seed in order for seed in (top_seed, 2 * len(order) + 1 - top_seed)]
+    return order
+
+
+def generate_data_file(data_filename, years, seed=0, first_four=False, field_size=64):
+    """
+    Writes a synthetic Game By Game file with a full, plausible tournament for
+    every year: lower seeds usually win and the top seeds are mostly ranked.
+
+    :param first_four: Whether to add First Four (opening round) games
+    :param field_size: The number of teams, 64 or a bigger power of two for
+                  stress testing
+    """
+    if field_size < 64 or field_size & (field_size - 1):
+        raise ValueError("Expecting a field of 64 teams or a bigger power of two, but found %d" % field_size)
+    rng = random.Random(seed)
+    with open(data_filename, 'w', newline='') as data_file:
+        writer = csv.writer(data_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(['Column %d' % column for column in range(Schema.LOSSES + 1)])
+        for year in years:
+            teams = [
+                ("%s %d University" % (region, team_seed), team_seed, region)
+                for region in REGION_ORDER for team_seed in seed_order(field_size // len(REGION_ORDER))
+            ]
+            contenders = [team for team in teams if team[1] <= 7]
+            rng.shuffle(contenders)
+            rankings = dict((team[0], str(ranking)) for (ranking, team) in enumerate(contenders[:RANKED_TEAMS], 1))
+
+            def write_game(round, loser, winner):
+                row = [''] * (Schema.LOSSES + 1)
+                row[Schema.YEAR] = str(year)
+                row[Schema.ROUND] = round
+                row[Schema.TEAM], row[Schema.SEED], row[Schema.REGION] = loser[0], str(loser[1]), loser[2]
+                row[Schema.OPPONENT], row[Schema.OPPONENT_SEED], row[Schema.OPPONENT_REGION] = winner[0], str(winner[1]), winner[2]
+                row[Schema.RANKING] = rankings.get(loser[0], '0')
+                row[Schema.OPPONENT_RANKING] = rankings.get(winner[0], '0')
+                row[Schema.WINS], row[Schema.LOSSES] = '0', '1'
+                writer.writerow(row)
+
+            if first_four:
+                # The 16 seeds of two regions and two at-large slots each came out of a play-in
+                for position in (1, 17, 41, 57):
+                    winner = teams[position]
+                    write_game(Schema.OPENING_ROUND, ("%s Play-In University" % winner[0], winner[1], winner[2]), winner)
+
+            remaining = teams
+            while len(remaining) > 1:
+                round = Schema.ROUNDS_BY_TEAMS[len(remaining)]
+                advancing = []
+                for top, bottom in zip(remaining[0::2], remaining[1::2]):
+                    top_wins = rng.random() < 0.5 + 0.03 * (bottom[1] - top[1])
+                    winner, loser = (top, bottom) if top_wins else (bottom, top)
+                    write_game(round, loser, winner)
+                    advancing.append(winner)
+                remaining = advancing
+
+
+def measure(function, repeat):
+    """Runs a function repeatedly, returning its timings and peak traced memory"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        function()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        seconds = time.perf_counter() - start
+
+        tracemalloc.start()
+        function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'operations': repeat,
+        'seconds': seconds,
+        'per_second': repeat / seconds if seconds else float('inf'),
+        'peak_bytes': peak_bytes
+    }
+
+
+def run_benchmarks(data_filename, year, repeat, samples):
+    strategy = DefaultStrategies.STRATEGIES[4]
+    rows = ncaa_simulations.build_year_mapping_for(data_filename, use_cache=False)[str(year)]
+    actual_bracket = ncaa_simulations.build_actual_bracket(year, rows)
+    predicted_bracket = actual_bracket.blank()
+    ncaa_simulations.perform_predictions(predicted_bracket, strategy, random.Random(strategy.seed))
+    rng = random.Random(strategy.seed)
+
+    def predict():
+        ncaa_simulations.perform_predictions(actual_bracket.blank(), strategy, rng)
+
+    def score():
+        predicted_bracket.reindex()
+        ncaa_simulations.compute_score(predicted_bracket, actual_bracket, strategy)
+
+    # Printing only does work when DEBUG is on
+    def render():
+        log_level = ncaa_simulations.LOG_LEVEL
+        ncaa_simulations.LOG_LEVEL = ncaa_simulations.DEBUG
+        try:
+            ncaa_simulations.print_as_bracket(predicted_bracket, actual_bracket)
+        finally:
+            ncaa_simulations.LOG_LEVEL = log_level
+
+    ncaa_simulations.build_year_mapping_for(data_filename)
+    phases = [
+        ('parse', lambda: ncaa_simulations.build_year_mapping_for(data_filename, use_cache=False), max(1, repeat // 100)),
+        ('parse_cached', lambda: ncaa_simulations.build_year_mapping_for(data_filename), max(1, repeat // 100)),
+        ('build', lambda: ncaa_simulations.build_actual_bracket(year, rows), max(1, repeat // 10)),
+        ('copy', actual_bracket.blank, repeat),
+        ('predict', predict, repeat),
+        ('score', score, repeat),
+        ('render', render, max(1, repeat // 10)),
+        ('exact', lambda: analytic.evaluate_strategy(actual_bracket, strategy), max(1, repeat // 100)),
+    ]
+    results = dict((name, measure(function, phase_repeat)) for (name, function, phase_repeat) in phases)
+
+    # The Monte Carlo engine is measured in simulated brackets rather than calls
+    monte_carlo = measure(lambda: montecarlo.evaluate_strategy(actual_bracket, strategy, samples), 1)
+    monte_carlo['operations'] = samples
+    monte_carlo['per_second'] = samples / monte_carlo['seconds']
+    results['monte_carlo'] = monte_carlo
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """The phases that got slower than the baseline by more than the tolerance"""
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result['per_second'] < baseline[name]['per_second'] * (1 - tolerance):
+            regressions.append((name, baseline[name]['per_second'], result['per_second']))
+    return regressions
+
+
+def main(output_filename, baseline_filename, tolerance, repeat, years, samples, field_size=64, first_four=False):
+    with tempfile.TemporaryDirectory() as directory:
+        data_filename = os.path.join(directory, 'Game By Game.csv')
+        first_year = 1985
+        generate_data_file(data_filename, range(first_year, first_year + years), first_four=first_four, field_size=field_size)
+        phases = run_benchmarks(data_filename, first_year, repeat, samples)
+
+    print("%s %s %s" % ('PHASE'.ljust(14), 'PER SECOND'.rjust(14), 'PEAK MEMORY'.rjust(14)))
+    for name, result in phases.items():
+        print("%s %14.1f %12.1fKB" % (name.ljust(14), result['per_second'], result['peak_bytes'] / 1024.0))
+
+    if output_filename:
+        with open(output_filename, 'w') as output_file:
+            json.dump({'python': platform.python_version(), 'phases': phases}, output_file, indent=2)
+
+    if baseline_filename:
+        with open(baseline_filename, 'r') as baseline_file:
+            regressions = compare(phases, json.load(baseline_file)['phases'], tolerance)
+        for name, baseline_rate, rate in regressions:
+            print("REGRESSION %s: %.1f/s down from %.1f/s" % (name, rate, baseline_rate))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", help="Where to save the results as JSON")
+    parser.add_argument("-b", "--baseline", help="Results saved by an earlier run to compare against")
+    parser.add_argument("-t", "--tolerance", help="The fraction of slowdown allowed before a phase counts as a regression", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("-r", "--repeat", help="How many times to repeat the fast phases", type=int, default=2000)
+    parser.add_argument("-y", "--years", help="How many years of synthetic data to generate", type=int, default=30)
+    parser.add_argument("-n", "--samples", help="The number of brackets to simulate for the Monte Carlo phase", type=int, default=100000)
+    parser.add_argument("--teams", dest="field_size", help="The size of the synthetic field, 64 or a bigger power of two", type=int, default=64)
+    parser.add_argument("--first-four", help="Add First Four (opening round) games to the synthetic field", action="store_true")
+    args = parser.parse_args()
+    main(args.output, args.baseline, args.tolerance, args.repeat, args.years, args.samples, args.field_size, args.first_four)
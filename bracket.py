@@ -0,0 +1,250 @@
+"""
+Compact, array-backed representation of a bracket used in the simulation hot
+path.  The linked Game tree from game.py is still what gets built from the data
+file, and is flattened into a Bracket once.
+"""
+
+from array import array
+
+from schema import Schema
+from matchups import MatchupTable
+
+EMPTY = -1
+
+_TOSS_ORDERS = {}
+
+
+def toss_order(rounds):
+    """
+    For every slot of a bracket with the given number of rounds, its position
+    in a post-order (left, right, game) walk from the championship.  This is
+    the order in which picks have always consumed coin tosses.
+    """
+    if rounds not in _TOSS_ORDERS:
+        first_round_start = (1 << (rounds - 1)) - 1
+        order = array('h', [0]) * ((1 << rounds) - 1)
+        position = 0
+        stack = [(0, False)]
+        while stack:
+            slot, expanded = stack.pop()
+            if expanded or slot >= first_round_start:
+                order[slot] = position
+                position += 1
+                continue
+            stack.extend(((slot, True), (2 * slot + 2, False), (2 * slot + 1, False)))
+        _TOSS_ORDERS[rounds] = order
+    return _TOSS_ORDERS[rounds]
+
+
+def round_index(round, rounds):
+    """
+    The index of a named round in a bracket with the given number of rounds: 1
+    for its first round up to rounds for the national championship, and 0 for
+    the opening round of play-in games.  Rounds bigger than the field's first
+    round come out below 1.
+    """
+    if round == Schema.OPENING_ROUND:
+        return 0
+    if round not in Schema.ROUND_TEAMS:
+        raise ValueError("Unknown round %s" % round)
+    return rounds - Schema.ROUND_TEAMS[round].bit_length() + 2
+
+
+class Bracket:
+    """
+    A bracket stored as a heap-ordered array of winners.  Slot 0 holds the
+    national championship, the games feeding slot i live in slots 2i + 1 and
+    2i + 2, and every round is a contiguous slice of the array.  Winners are
+    indices into the team tables, which list teams in first round order and are
+    shared (read-only) between every copy of the bracket.  The bracket is sized
+    by its number of teams, any power of two; play-in games (as in 65 and 68
+    team fields) are kept beside it, already decided, and are not picked or
+    scored.
+
+    :param names: Team names, in first round order
+    :param seeds: Team seeds, in first round order
+    :param rankings: Team season rankings (0 if unranked), in first round order
+    :param regions: Team regions, in first round order
+    :param winners: Index of the winning team for every slot (EMPTY if undecided)
+    :param matchups: The MatchupTable of the teams, if already built
+    :param year: The year of the tournament, if known
+    :param play_ins: Mapping of the index of every team that won a play-in game
+                     to the (name, seed, region, ranking) of the team it beat
+    """
+    def __init__(self, names, seeds, rankings, regions, winners=None, matchups=None, year=None, play_ins=None):
+        self.names = names
+        self.seeds = seeds
+        self.rankings = rankings
+        self.regions = regions
+        self.teams = len(names)
+        self.games = self.teams - 1
+        self.rounds = self.teams.bit_length() - 1
+        if self.teams < 2 or self.teams != 1 << self.rounds:
+            raise ValueError("Expecting a power of two number of teams, but found %d" % self.teams)
+        self.first_round_start = self.games // 2
+        self.max_score = self.rounds * (self.teams // 2)
+        self.toss_order = toss_order(self.rounds)
+
+        if winners is None:
+            winners = array('h', [EMPTY]) * self.games
+        if len(winners) != self.games:
+            raise ValueError("Expecting %d winners, but found %d" % (self.games, len(winners)))
+        self.winners = winners
+        self.year = year
+        self.play_ins = play_ins if play_ins is not None else {}
+        self._matchups = matchups
+        self.reindex()
+
+    @property
+    def matchups(self):
+        """The MatchupTable of the teams, built on first use and shared with every copy"""
+        if self._matchups is None:
+            self._matchups = MatchupTable(self)
+        return self._matchups
+
+    def round_slice(self, round_index):
+        """The slots holding the games of a round (1 is the first round)"""
+        return slice((1 << (self.rounds - round_index)) - 1, (1 << (self.rounds - round_index + 1)) - 1)
+
+    def round_of(self, slot):
+        return self.rounds - (slot + 1).bit_length() + 1
+
+    def round_name(self, round_index):
+        if round_index == 0:
+            return Schema.OPENING_ROUND
+        return Schema.ROUNDS_BY_TEAMS[1 << (self.rounds - round_index + 1)]
+
+    def round_index(self, round):
+        return round_index(round, self.rounds)
+
+    def round_winners(self, round_index):
+        return self.winners[self.round_slice(round_index)]
+
+    def round_winner_set(self, round_index):
+        """
+        The teams winning a game in a round.  The per-round index is built on
+        first use and kept up to date by set_winner.
+        """
+        if self._winner_sets is None:
+            self._winner_sets = [None] + [
+                set(self.round_winners(round_index)) - {EMPTY} for round_index in range(1, self.rounds + 1)
+            ]
+        return self._winner_sets[round_index]
+
+    def round_winner_names(self, round_index):
+        """The names of the teams winning a game in a round (see round_winner_set)"""
+        if self._winner_names is None:
+            self._winner_names = [None] * (self.rounds + 1)
+        if self._winner_names[round_index] is None:
+            self._winner_names[round_index] = set(self.names[team] for team in self.round_winner_set(round_index))
+        return self._winner_names[round_index]
+
+    def set_winner(self, slot, team):
+        """Decides a slot, updating the per-round index if it has been built"""
+        previous_team = self.winners[slot]
+        self.winners[slot] = team
+        round_index = self.round_of(slot)
+        if self._winner_sets is not None:
+            self._winner_sets[round_index].discard(previous_team)
+            if team != EMPTY:
+                self._winner_sets[round_index].add(team)
+        if self._winner_names is not None:
+            self._winner_names[round_index] = None
+
+    def reindex(self):
+        """Drops the per-round index after the winners were written directly"""
+        self._winner_sets = None
+        self._winner_names = None
+
+    def slot_teams(self, slot):
+        """The two teams meeting in a slot, left (upper) side first"""
+        if slot >= self.first_round_start:
+            left = 2 * (slot - self.first_round_start)
+            return left, left + 1
+        return self.winners[2 * slot + 1], self.winners[2 * slot + 2]
+
+    def favorite(self, left, right, first_round=False):
+        """
+        Orders two teams as (favorite, underdog) by seed, falling back on the
+        season rankings for teams with the same seed.
+        """
+        if self.seeds[left] < self.seeds[right]:
+            return left, right
+        if self.seeds[left] > self.seeds[right]:
+            return right, left
+        if first_round:
+            return left, right
+
+        left_ranking = self.rankings[left]
+        right_ranking = self.rankings[right]
+        if left_ranking == 0 and right_ranking == 0:
+            # BOTH UNRANKED TEAMS... PICK THE LEFT ONE
+            return left, right
+        elif left_ranking > right_ranking or left_ranking == 0:
+            return right, left
+        elif right_ranking > left_ranking or right_ranking == 0:
+            return left, right
+        raise ValueError("Inception")
+
+    def blank(self):
+        """A copy of this bracket with every game undecided"""
+        return Bracket(self.names, self.seeds, self.rankings, self.regions, matchups=self.matchups, year=self.year, play_ins=self.play_ins)
+
+    def copy(self):
+        return self.with_winners(array('h', self.winners))
+
+    def with_winners(self, winners):
+        """A bracket over the same teams with the given winners"""
+        return Bracket(self.names, self.seeds, self.rankings, self.regions, winners, self.matchups, self.year, self.play_ins)
+
+    @staticmethod
+    def from_game(root, season_rankings, year=None):
+        """
+        Flattens a complete, linked Game tree into a Bracket, sized by the
+        number of rounds down to the first.  Play-in games linked into the
+        first round are kept as the bracket's play_ins.
+
+        :param root: The national championship game
+        :param season_rankings: Mapping of team name to season ranking
+        :param year: The year of the tournament
+        """
+        rounds = 0
+        game = root
+        while game and game.round != Schema.OPENING_ROUND:
+            rounds += 1
+            game = game.winner_previous_game
+        first_round_start = (1 << (rounds - 1)) - 1
+
+        games = [root]
+        for slot in range(first_round_start):
+            game = games[slot]
+            if not game.winner_previous_game or not game.loser_previous_game:
+                raise ValueError("Incomplete bracket, missing previous games for %s" % game)
+            games.append(game.winner_previous_game)
+            games.append(game.loser_previous_game)
+
+        names = []
+        seeds = array('b')
+        rankings = array('h')
+        regions = []
+        for game in games[first_round_start:]:
+            for name, seed, region in ((game.winner_name, game.winner_seed, game.winner_region),
+                                       (game.loser_name, game.loser_seed, game.loser_region)):
+                names.append(name)
+                seeds.append(seed)
+                rankings.append(int(season_rankings[name]))
+                regions.append(region)
+
+        team_indices = dict((name, index) for (index, name) in enumerate(names))
+        if len(team_indices) != len(names):
+            raise ValueError("Found a team playing more than one first round game")
+        winners = array('h', (team_indices[game.winner_name] for game in games))
+
+        play_ins = {}
+        for game in games[first_round_start:]:
+            for play_in in (game.winner_previous_game, game.loser_previous_game):
+                if play_in:
+                    play_ins[team_indices[play_in.winner_name]] = (
+                        play_in.loser_name, play_in.loser_seed, play_in.loser_region, int(season_rankings[play_in.loser_name])
+                    )
+        return Bracket(names, seeds, rankings, regions, winners, year=year, play_ins=play_ins)
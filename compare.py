@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""
+Compares strategies by simulation with common random numbers: within a year
+every strategy picks from the same coin tosses, so the difference between two
+strategies' scores is measured on identical draws and varies far less than
+either score.  Each (strategy, year) pair keeps sampling only until the
+confidence interval of its difference from a baseline strategy (or of its own
+mean, for the baseline) is tight enough, or the sign of that difference is
+clear.
+"""
+
+import argparse
+import math
+import statistics
+
+import numpy
+
+import montecarlo
+from ncaa_simulations import INFO, JUSTIFICATION_SIZE, build_actual_bracket, load_years, log
+from seedhistory import SeedHistory, seed_history_strategies
+from strategy import DefaultStrategies
+
+DEFAULT_PRECISION = 0.5
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MIN_SAMPLES = 1000
+DEFAULT_MAX_SAMPLES = 1000000
+
+
+class RunningMean:
+    """The count, mean and variance of a stream of samples, added in batches"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def add(self, values):
+        values = numpy.asarray(values, dtype=numpy.float64)
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.total_squares += float(values @ values)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return float('inf')
+        return max(self.total_squares - self.count * self.mean ** 2, 0.0) / (self.count - 1)
+
+    def half_width(self, z):
+        """Half the width of the confidence interval of the mean for a normal quantile"""
+        return z * math.sqrt(self.variance / self.count) if self.count else float('inf')
+
+
+class Comparison:
+    """
+    The sampled scores of one strategy in one year, and the differences from
+    the baseline strategy's scores on the same tosses.
+    """
+    def __init__(self, strategy, is_baseline):
+        self.strategy = strategy
+        self.is_baseline = is_baseline
+        self.scores = RunningMean()
+        self.differences = None if is_baseline else RunningMean()
+        self.stopped = None
+
+    @property
+    def tested(self):
+        """What the stopping rule looks at: the mean for the baseline, otherwise the difference"""
+        return self.scores if self.is_baseline else self.differences
+
+
+def looks_for(min_samples, max_samples):
+    """How many times a pair is checked when its sample count doubles from min_samples"""
+    return max(1, math.ceil(math.log2(max(max_samples, min_samples) / min_samples)) + 1)
+
+
+def compare_year(actual_bracket, strategies, year, baseline=0, precision=DEFAULT_PRECISION, confidence=DEFAULT_CONFIDENCE,
+                 min_samples=DEFAULT_MIN_SAMPLES, max_samples=DEFAULT_MAX_SAMPLES, seed=DefaultStrategies.SEED):
+    """
+    Samples every strategy's score in a year from one stream of coin tosses,
+    doubling the number of samples until every pair has stopped.  A pair stops
+    once the confidence interval of what it tests is within precision points
+    either side, or for non-baselines once it excludes zero.  Intervals are
+    widened for the number of looks so stopping early keeps its confidence.
+
+    :param baseline: The index of the strategy the others are compared with
+    :return: A Comparison for every strategy, in order
+    """
+    comparisons = [Comparison(strategy, index == baseline) for (index, strategy) in enumerate(strategies)]
+    z = statistics.NormalDist().inv_cdf(1 - (1 - confidence) / (2 * looks_for(min_samples, max_samples)))
+    weights = montecarlo.round_weights(actual_bracket)
+    rng = numpy.random.default_rng([seed, year])
+
+    active = set(range(len(strategies)))
+    drawn = 0
+    while active and drawn < max_samples:
+        count = min(max(min_samples, drawn), max_samples - drawn)
+        tosses = rng.random((count, actual_bracket.games))
+        sampled = active | {baseline}
+        scores = dict(
+            (index, montecarlo.score_predictions(montecarlo.simulate_predictions(actual_bracket, strategies[index], tosses), actual_bracket, weights))
+            for index in sampled
+        )
+        for index in sampled:
+            comparisons[index].scores.add(scores[index])
+            if index != baseline:
+                comparisons[index].differences.add(scores[index] - scores[baseline])
+        drawn += count
+
+        for index in sorted(active):
+            tested = comparisons[index].tested
+            half_width = tested.half_width(z)
+            if half_width <= precision:
+                comparisons[index].stopped = 'precise'
+            elif index != baseline and abs(tested.mean) > half_width:
+                comparisons[index].stopped = 'clear'
+            if comparisons[index].stopped:
+                active.discard(index)
+
+    for index in active:
+        comparisons[index].stopped = 'budget'
+    for comparison in comparisons:
+        comparison.half_width = comparison.tested.half_width(z)
+    return comparisons
+
+
+def print_year(year, comparisons):
+    baseline = next(comparison for comparison in comparisons if comparison.is_baseline)
+    log(INFO, "%s\n----", year)
+    log(INFO, "%s %s %s %s %s %s", 'STRATEGY'.ljust(JUSTIFICATION_SIZE), 'MEAN'.rjust(15), 'VS. BASELINE'.rjust(22),
+        'SAMPLES'.rjust(9), 'REDUCTION'.rjust(9), 'STOPPED')
+    for comparison in comparisons:
+        reduction = ''
+        if comparison.is_baseline:
+            difference = 'BASELINE'
+            mean = "%6.1f +/- %4.1f" % (comparison.scores.mean, comparison.half_width)
+        else:
+            difference = "%+6.1f +/- %4.1f" % (comparison.differences.mean, comparison.half_width)
+            mean = "%6.1f" % comparison.scores.mean
+            # How much less the paired difference varies than that of independent runs
+            if comparison.differences.variance > 0:
+                reduction = "%8.1fx" % ((comparison.scores.variance + baseline.scores.variance) / comparison.differences.variance)
+        log(INFO, "%s %s %s %9d %s %s", (comparison.strategy.name + ':').ljust(JUSTIFICATION_SIZE), mean.rjust(15), difference.rjust(22),
+            comparison.scores.count, reduction.rjust(9), comparison.stopped)
+    log(INFO, "")
+
+
+def main(data_file, years, strategies, baseline=0, precision=DEFAULT_PRECISION, confidence=DEFAULT_CONFIDENCE,
+         min_samples=DEFAULT_MIN_SAMPLES, max_samples=DEFAULT_MAX_SAMPLES, use_cache=True):
+    differences = dict((strategy.name, []) for strategy in strategies)
+    simulated = 0
+    for year, tournament_games in load_years(data_file, years, use_cache):
+        comparisons = compare_year(build_actual_bracket(year, tournament_games), strategies, year, baseline, precision, confidence, min_samples, max_samples)
+        print_year(year, comparisons)
+        simulated += sum(comparison.scores.count for comparison in comparisons)
+        for comparison in comparisons:
+            if not comparison.is_baseline:
+                differences[comparison.strategy.name].append(comparison.differences.mean)
+
+    log(INFO, "%s %s", ('AVERAGE VS. %s' % strategies[baseline].name).ljust(JUSTIFICATION_SIZE + 1), 'DIFFERENCE'.rjust(10))
+    for strategy in strategies:
+        if differences[strategy.name]:
+            log(INFO, "%s %+10.1f", (strategy.name + ':').ljust(JUSTIFICATION_SIZE + 1), statistics.mean(differences[strategy.name]))
+    budget = len(strategies) * len(years) * max_samples
+    log(INFO, "\nSimulated %d brackets instead of %d (%.1f%%)", simulated, budget, 100.0 * simulated / budget)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--file", help="The data file to read in", required=True)
+    parser.add_argument("-y", "--years", help="A list of years to compare strategies on", nargs='+', type=int, required=True)
+    parser.add_argument("-b", "--baseline", help="The name of the strategy to compare the others with (the first one if not given)")
+    parser.add_argument("-p", "--precision", help="Stop once the confidence interval is this many points either side", type=float, default=DEFAULT_PRECISION)
+    parser.add_argument("-c", "--confidence", help="The confidence of the intervals", type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument("--min-samples", help="The number of brackets to simulate before checking a pair", type=int, default=DEFAULT_MIN_SAMPLES)
+    parser.add_argument("-n", "--max-samples", help="The most brackets to simulate per strategy and year", type=int, default=DEFAULT_MAX_SAMPLES)
+    parser.add_argument("-s", "--seed-history", help="Add the seed history strategies, see ncaa_simulations.py", action="store_true")
+    parser.add_argument("--no-cache", help="Always parse the data file instead of using its binary cache", dest="use_cache", action="store_false")
+    args = parser.parse_args()
+
+    strategies = DefaultStrategies.STRATEGIES
+    if args.seed_history:
+        strategies = strategies + seed_history_strategies(SeedHistory.load(args.file))
+    names = [strategy.name for strategy in strategies]
+    if args.baseline is not None and args.baseline not in names:
+        parser.error("unknown baseline %s, expecting one of: %s" % (args.baseline, ', '.join(names)))
+    baseline = names.index(args.baseline) if args.baseline else 0
+    main(args.file, args.years, strategies, baseline, args.precision, args.confidence, args.min_samples, args.max_samples, args.use_cache)
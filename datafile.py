@@ -0,0 +1,393 @@
+"""
+Reading the Game By Game CSV described in schema.py.  Besides parsing the CSV
+directly, the columns that the simulations use can be converted once into a
+compact binary cache next to the data file, which later runs memory map instead
+of parsing the CSV again.  Without the cache, seasons can be streamed one at a
+time, optionally seeking straight to them through a year index.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+
+from array import array
+
+from schema import Schema
+
+CACHE_SUFFIX = '.cache'
+CACHE_MAGIC = b'NCAACACHE\x01'
+CACHE_ALIGNMENT = 8
+INDEX_SUFFIX = '.index'
+
+# Columns kept in the cache, and the string table that interns each of them
+CACHED_COLUMNS = {
+    Schema.YEAR                 : None,
+    Schema.TEAM                 : 'teams',
+    Schema.RANKING              : None,
+    Schema.SEED                 : None,
+    Schema.OPPONENT             : 'teams',
+    Schema.ROUND                : 'rounds',
+    Schema.REGION               : 'regions',
+    Schema.OPPONENT_RANKING     : None,
+    Schema.OPPONENT_SEED        : None,
+    Schema.OPPONENT_REGION      : 'regions',
+    Schema.WINS                 : None,
+    Schema.LOSSES               : None
+}
+
+
+def create_reader(data_file):
+    return csv.reader(data_file, quotechar='"', delimiter=',', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+
+def read_rows(data_file):
+    """Yields every row of an open data file, skipping the header"""
+    reader = create_reader(data_file)
+    next(reader, None)
+    yield from reader
+
+
+def stream_years(data_filename, years=None):
+    """
+    Yields (year, rows) for every season in a data file, in file order, holding
+    a single season in memory at a time.  Rows of years that were not asked for
+    are skipped without being kept.  Seasons are expected to be contiguous (as
+    they are in the hoopstournament data), use YearIndex if they are not.
+
+    :param years: The years (as strings) to yield, or None for every year
+    """
+    seen_years = set()
+    current_year = None
+    current_rows = []
+    with open(data_filename, 'r') as data_file:
+        for row in read_rows(data_file):
+            year = row[Schema.YEAR]
+            if year != current_year:
+                if current_rows:
+                    yield current_year, current_rows
+                if year in seen_years:
+                    raise ValueError("Rows for %s are not contiguous in %s" % (year, data_filename))
+                seen_years.add(year)
+                current_year = year
+                current_rows = []
+            if years is None or year in years:
+                current_rows.append(row)
+    if current_rows:
+        yield current_year, current_rows
+
+
+def read_years(data_filename, years, use_index=True):
+    """
+    Yields (year, rows) for the requested years (as strings).  With the index
+    the years come in the requested order and a missing year has no rows,
+    otherwise they are streamed in file order.
+    """
+    if not use_index:
+        yield from stream_years(data_filename, set(years))
+        return
+
+    index = YearIndex.load(data_filename)
+    with open(data_filename, 'rb') as data_file:
+        for year in years:
+            yield year, index.read_rows(data_file, year)
+
+
+def describe_source(data_filename, with_hash=True):
+    stat = os.stat(data_filename)
+    source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(data_filename, 'rb') as data_file:
+            for block in iter(lambda: data_file.read(1 << 20), b''):
+                digest.update(block)
+        source['sha256'] = digest.hexdigest()
+    return source
+
+
+def matches_source(data_filename, cached_source):
+    """
+    Whether a data file is still the one described by describe_source.  When
+    only its modification time moved (a touch or a checkout) and its hash still
+    matches, cached_source is updated in place, so the caller can save it and
+    skip hashing the file again on the next load.
+    """
+    source = describe_source(data_filename, with_hash=False)
+    if (cached_source['size'], cached_source['mtime_ns']) == (source['size'], source['mtime_ns']):
+        return True
+    if describe_source(data_filename)['sha256'] != cached_source['sha256']:
+        return False
+    cached_source.update(source)
+    return True
+
+
+def has_source(contents, *keys):
+    """Whether decoded contents are a mapping with the keys and a source as written by describe_source"""
+    return (isinstance(contents, dict) and all(key in contents for key in keys) and isinstance(contents.get('source'), dict)
+            and all(key in contents['source'] for key in ('size', 'mtime_ns', 'sha256')))
+
+
+def load_json(filename, *keys):
+    """
+    The contents of a JSON file saved next to a data file, or None if it is
+    missing, cannot be decoded or lacks the source or any of the keys, so that
+    it gets rebuilt instead.
+    """
+    try:
+        with open(filename, 'r') as json_file:
+            contents = json.load(json_file)
+    except (OSError, ValueError):
+        return None
+    return contents if has_source(contents, *keys) else None
+
+
+def save_json(filename, contents):
+    """Writes a JSON file through a temporary file, leaving it unsaved if that fails"""
+    try:
+        with open(filename + '.tmp', 'w') as json_file:
+            json.dump(contents, json_file)
+        os.replace(filename + '.tmp', filename)
+    except OSError:
+        pass
+
+
+class YearIndex:
+    """
+    Where every season lives in a data file, as (offset, length) byte spans of
+    whole lines, so a season can be read without touching the rest of the file.
+
+    :param years: Mapping of year (as a string) to its list of spans
+    """
+    def __init__(self, years):
+        self.years = years
+
+    def read_rows(self, data_file, year):
+        """Parses the rows of a year from a data file opened in binary mode"""
+        rows = []
+        for offset, length in self.years.get(year, []):
+            data_file.seek(offset)
+            rows.extend(create_reader(io.TextIOWrapper(io.BytesIO(data_file.read(length)))))
+        return rows
+
+    @staticmethod
+    def load(data_filename):
+        """
+        Reads the index of a data file, (re)building it first if it is missing
+        or out of date.  If the index cannot be saved it is only kept in memory.
+        """
+        index_filename = data_filename + INDEX_SUFFIX
+        contents = load_json(index_filename, 'years')
+        if contents is not None:
+            mtime_ns = contents['source']['mtime_ns']
+            if matches_source(data_filename, contents['source']):
+                if contents['source']['mtime_ns'] != mtime_ns:
+                    save_json(index_filename, contents)
+                return YearIndex(contents['years'])
+
+        source = describe_source(data_filename)
+        index = YearIndex.build(data_filename)
+        save_json(index_filename, {'source': source, 'years': index.years})
+        return index
+
+    @staticmethod
+    def build(data_filename):
+        years = {}
+        with open(data_filename, 'rb') as data_file:
+            offset = len(data_file.readline())
+            for line in data_file:
+                # Only the year is needed, and latin-1 decodes any byte
+                row = next(create_reader([line.decode('latin-1')]), None)
+                if row:
+                    spans = years.setdefault(row[Schema.YEAR], [])
+                    if spans and spans[-1][0] + spans[-1][1] == offset:
+                        spans[-1][1] += len(line)
+                    else:
+                        spans.append([offset, len(line)])
+                offset += len(line)
+        return YearIndex(years)
+
+
+class CachedRow:
+    """
+    A read-only view of one row of a ColumnCache.  Indexing it with a Schema
+    column gives the same string the CSV holds for the cached columns.
+    """
+    __slots__ = ('cache', 'index')
+
+    def __init__(self, cache, index):
+        self.cache = cache
+        self.index = index
+
+    def __getitem__(self, column):
+        return self.cache.value(column, self.index)
+
+    def __repr__(self):
+        return repr(dict((column, self[column]) for column in CACHED_COLUMNS))
+
+
+class ColumnCache:
+    """
+    The cached columns of a data file, with rows grouped by year.  Integer
+    columns are stored as small ints, and string columns (or integer columns
+    holding anything else) as ids into interned string tables.
+
+    :param header: The decoded cache header
+    :param buffer: The cache contents (usually memory mapped)
+    :param data_start: Where the columns start in the buffer
+    """
+    def __init__(self, header, buffer, data_start):
+        self.header = header
+        self.years = dict((year, tuple(bounds)) for (year, bounds) in header['years'].items())
+        self.tables = header['tables']
+        self.columns = {}
+        view = memoryview(buffer)
+        rows = header['rows']
+        for column, layout in header['columns'].items():
+            start = data_start + layout['offset']
+            stop = start + rows * array(layout['typecode']).itemsize
+            self.columns[int(column)] = (layout['table'], view[start:stop].cast(layout['typecode']))
+
+    def value(self, column, index):
+        table, values = self.columns[column]
+        if table is None:
+            return str(values[index])
+        return self.tables[table][values[index]]
+
+    def rows_for(self, year):
+        start, stop = self.years.get(year, (0, 0))
+        return [CachedRow(self, index) for index in range(start, stop)]
+
+    def year_mapping(self):
+        return dict((year, self.rows_for(year)) for year in self.years)
+
+    @staticmethod
+    def load(data_filename):
+        """
+        Memory maps the cache of a data file, (re)building it first if it is
+        missing or the data file's size, modification time and hash do not match.
+        """
+        cache_filename = data_filename + CACHE_SUFFIX
+        header = None
+        if os.path.exists(cache_filename):
+            header, _ = ColumnCache._read_header(cache_filename)
+        if header is not None:
+            mtime_ns = header['source']['mtime_ns']
+            if not matches_source(data_filename, header['source']):
+                header = None
+            elif header['source']['mtime_ns'] != mtime_ns:
+                ColumnCache._write_header(cache_filename, header)
+        if header is None:
+            ColumnCache.build(data_filename, cache_filename)
+
+        header, data_start = ColumnCache._read_header(cache_filename)
+        with open(cache_filename, 'rb') as cache_file:
+            buffer = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return ColumnCache(header, buffer, data_start)
+
+    @staticmethod
+    def _read_header(cache_filename):
+        """
+        The decoded header of a cache file and where its columns start, or
+        (None, None) if the file is not a cache or is truncated or corrupt.
+        """
+        with open(cache_filename, 'rb') as cache_file:
+            if cache_file.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None, None
+            try:
+                (header_size,) = struct.unpack('<I', cache_file.read(4))
+                header = json.loads(cache_file.read(header_size).decode('utf-8'))
+                if not has_source(header, 'rows', 'years', 'tables', 'columns'):
+                    return None, None
+                data_start = _align(len(CACHE_MAGIC) + 4 + header_size)
+                data_end = max([data_start + layout['offset'] + header['rows'] * array(layout['typecode']).itemsize
+                                for layout in header['columns'].values()] + [data_start])
+            except (struct.error, ValueError, KeyError, TypeError):
+                return None, None
+            if os.fstat(cache_file.fileno()).st_size < data_end:
+                return None, None
+        return header, data_start
+
+    @staticmethod
+    def _write_header(cache_filename, header):
+        """
+        Replaces the header of a cache file, keeping its columns.  Their offsets
+        are relative to where they start, so the header may change size.  If
+        the cache cannot be saved it is left as it was.
+        """
+        _, data_start = ColumnCache._read_header(cache_filename)
+        encoded_header = json.dumps(header).encode('utf-8')
+        temporary_filename = cache_filename + '.tmp'
+        try:
+            with open(cache_filename, 'rb') as cache_file:
+                cache_file.seek(data_start)
+                columns = cache_file.read()
+            with open(temporary_filename, 'wb') as cache_file:
+                cache_file.write(CACHE_MAGIC + struct.pack('<I', len(encoded_header)) + encoded_header)
+                cache_file.seek(_align(len(CACHE_MAGIC) + 4 + len(encoded_header)))
+                cache_file.write(columns)
+            os.replace(temporary_filename, cache_filename)
+        except OSError:
+            pass
+
+    @staticmethod
+    def build(data_filename, cache_filename):
+        """Converts the cached columns of a data file into a cache file"""
+        source = describe_source(data_filename)
+        with open(data_filename, 'r') as data_file:
+            rows = sorted(read_rows(data_file), key=lambda row: row[Schema.YEAR])
+
+        years = {}
+        for index, row in enumerate(rows):
+            year = row[Schema.YEAR]
+            years[year] = [years[year][0] if year in years else index, index + 1]
+
+        tables = {}
+        table_ids = {}
+        encoded_columns = {}
+        for column, table in CACHED_COLUMNS.items():
+            values = [row[column] for row in rows]
+            if table is None and all(_is_small_int(value) for value in values):
+                encoded_columns[column] = (None, array('h', (int(value) for value in values)))
+                continue
+
+            # Anything that is not a small integer gets interned
+            table = table or 'column_%d' % column
+            strings = tables.setdefault(table, [])
+            ids = table_ids.setdefault(table, {})
+            for value in values:
+                if value not in ids:
+                    ids[value] = len(strings)
+                    strings.append(value)
+            encoded_columns[column] = (table, array('H' if len(strings) <= 65536 else 'I', (ids[value] for value in values)))
+
+        # Columns follow the header, each aligned so it can be cast in place
+        header = {'source': source, 'rows': len(rows), 'years': years, 'tables': tables, 'columns': {}}
+        offset = 0
+        for column, (table, values) in encoded_columns.items():
+            header['columns'][str(column)] = {'table': table, 'typecode': values.typecode, 'offset': offset}
+            offset = _align(offset + len(values) * values.itemsize)
+        encoded_header = json.dumps(header).encode('utf-8')
+        data_start = _align(len(CACHE_MAGIC) + 4 + len(encoded_header))
+
+        temporary_filename = cache_filename + '.tmp'
+        with open(temporary_filename, 'wb') as cache_file:
+            cache_file.write(CACHE_MAGIC + struct.pack('<I', len(encoded_header)) + encoded_header)
+            for column, (table, values) in encoded_columns.items():
+                cache_file.seek(data_start + header['columns'][str(column)]['offset'])
+                values.tofile(cache_file)
+        os.replace(temporary_filename, cache_filename)
+
+
+def _is_small_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        return False
+    return str(number) == value and -32768 <= number <= 32767
+
+
+def _align(offset):
+    return (offset + CACHE_ALIGNMENT - 1) // CACHE_ALIGNMENT * CACHE_ALIGNMENT
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+"""
+The brackets a Strategy is most likely to pick.  A strategy's picks are a
+random bracket whose probability is the product of the pick probabilities of
+its games (see analytic.pick_probabilities), so the chance of a perfect bracket
+is one product along the actual bracket.  The K most likely brackets come from
+keeping, for every slot and every team that could win it, the K most likely
+sub-brackets with that team on top, and combining them up the bracket instead
+of searching all 2^63 brackets.  The bracket with the highest expected score,
+if the tournament plays out the way the strategy picks it, comes from the same
+kind of pass over the strategy's advancement probabilities.
+"""
+
+import argparse
+import math
+
+from array import array
+
+import numpy
+
+import ncaa_simulations
+
+from analytic import advancement_probabilities, pick_probabilities
+from bracket import EMPTY
+from montecarlo import round_weights, score_predictions
+from ncaa_simulations import DEBUG, INFO, JUSTIFICATION_SIZE, build_actual_bracket, load_years, log, print_as_bracket
+from render import FORMATS, render_all
+from seedhistory import SeedHistory, seed_history_strategies
+from strategy import DefaultStrategies
+
+DEFAULT_TOP = 10
+# Small enough never to reorder brackets that differ in probability, only ties
+TIE_BREAK = 1e-12
+
+
+def slot_teams(bracket, round_index, slot):
+    """The teams that could win a slot: its subtree's first round positions, left half first"""
+    subtree_teams = 1 << round_index
+    start = (slot - bracket.round_slice(round_index).start) * subtree_teams
+    return numpy.arange(start, start + subtree_teams)
+
+
+def perfect_probability(actual_bracket, strategy):
+    """The probability that the strategy picks every game of the actual bracket"""
+    winners = numpy.asarray(actual_bracket.winners, dtype=numpy.int16)
+    log_probability = 0.0
+    with numpy.errstate(divide='ignore'):
+        for round_index in range(1, actual_bracket.rounds + 1):
+            slots = numpy.arange(actual_bracket.round_slice(round_index).start, actual_bracket.round_slice(round_index).stop)
+            if round_index == 1:
+                left = 2 * (slots - slots[0])
+                right = left + 1
+            else:
+                left, right = winners[2 * slots + 1], winners[2 * slots + 2]
+            left_picked = pick_probabilities(actual_bracket, strategy, round_index, left, right)
+            log_probability += numpy.log(numpy.where(winners[slots] == left, left_picked, 1.0 - left_picked)).sum()
+    return math.exp(log_probability)
+
+
+def preference_order(bracket, strategy):
+    """
+    How teams are ranked when picking between equally good choices: by seed,
+    then season ranking, then a shuffle from the strategy's seed.  Ties are
+    never left to team order, which follows the actual results.
+    """
+    shuffle = numpy.random.default_rng([strategy.seed, bracket.year or 0]).random(bracket.teams)
+    rankings = [ranking if ranking else bracket.teams + 1000 for ranking in bracket.rankings]
+    preference = numpy.empty(bracket.teams, dtype=numpy.int32)
+    preference[numpy.lexsort((shuffle, rankings, list(bracket.seeds)))] = numpy.arange(bracket.teams)
+    return preference
+
+
+def _preferred(values, preference):
+    """The index of the largest value, breaking ties by preference"""
+    candidates = numpy.flatnonzero(values >= values.max() - 1e-9)
+    return int(candidates[numpy.argmin(preference[candidates])])
+
+
+def _top(values, k):
+    """The column indices of the k largest values of every row, largest first"""
+    if values.shape[1] > k:
+        indices = numpy.argpartition(-values, k - 1, axis=1)[:, :k]
+    else:
+        indices = numpy.broadcast_to(numpy.arange(values.shape[1]), values.shape)
+    order = numpy.argsort(-numpy.take_along_axis(values, indices, 1), axis=1, kind='stable')
+    return numpy.take_along_axis(indices, order, 1)
+
+
+def _rank_pairs(own_width, through_width, k):
+    """
+    The (own, through) ranks worth combining from two sorted lists: a pair
+    (a, c) is beaten by the (a + 1)(c + 1) - 1 pairs above and left of it, so
+    only pairs with (a + 1)(c + 1) <= k can make the top k.
+    """
+    own_ranks = []
+    through_ranks = []
+    for own_rank in range(min(own_width, k)):
+        count = min(through_width, k // (own_rank + 1))
+        own_ranks.extend([own_rank] * count)
+        through_ranks.extend(range(count))
+    return numpy.array(own_ranks), numpy.array(through_ranks)
+
+
+def _best_for_side(own_best, opponent_best, log_wins, k):
+    """
+    The k most likely sub-brackets of a slot for every team on one side of it.
+
+    :param own_best: own_best[i] are the sorted log probabilities of team i's
+                     sub-brackets on its own side
+    :param opponent_best: The same for the teams on the other side
+    :param log_wins: log_wins[i, j] is the log probability of picking i over j
+    :return: The sorted log probabilities, and for each the opponent, the rank
+             of the own sub-bracket and the rank of the opponent's sub-bracket
+    """
+    teams, opponents = log_wins.shape
+    opponent_width = opponent_best.shape[1]
+    # The k most likely ways through the other side: an opponent, one of its sub-brackets, and beating it
+    through = (log_wins[:, :, None] + opponent_best[None, :, :]).reshape(teams, opponents * opponent_width)
+    through_order = _top(through, k)
+    through_best = numpy.take_along_axis(through, through_order, 1)
+
+    own_ranks, through_ranks = _rank_pairs(own_best.shape[1], through_best.shape[1], k)
+    combined = own_best[:, own_ranks] + through_best[:, through_ranks]
+    order = _top(combined, k)
+    through_index = numpy.take_along_axis(through_order, through_ranks[order], 1)
+    return (numpy.take_along_axis(combined, order, 1), through_index // opponent_width, own_ranks[order],
+            through_index % opponent_width)
+
+
+def most_likely_brackets(bracket, strategy, k=DEFAULT_TOP):
+    """
+    The k brackets the strategy is most likely to pick, found exactly by
+    keeping the k most likely sub-brackets for every team winning every slot.
+
+    :return: List of (probability, winners) from the most likely down, with
+             fewer than k entries if the strategy can only pick fewer brackets
+    """
+    # Equally likely brackets are ordered by preference_order, by nudging every pick by its team's preference
+    ties = TIE_BREAK * preference_order(bracket, strategy) / bracket.teams
+    best = [None] * bracket.games
+    choices = [None] * bracket.games
+    with numpy.errstate(divide='ignore'):
+        for round_index in range(1, bracket.rounds + 1):
+            round_slice = bracket.round_slice(round_index)
+            for slot in range(round_slice.start, round_slice.stop):
+                teams = slot_teams(bracket, round_index, slot)
+                left, right = teams[:len(teams) // 2], teams[len(teams) // 2:]
+                if round_index == 1:
+                    left_best = right_best = numpy.zeros((1, 1))
+                else:
+                    left_best, right_best = best[2 * slot + 1], best[2 * slot + 2]
+
+                left_picked = pick_probabilities(bracket, strategy, round_index, left[:, None], right[None, :])
+                left_side = _best_for_side(left_best, right_best, numpy.log(left_picked) - ties[left][:, None], k)
+                right_side = _best_for_side(right_best, left_best, numpy.log(1.0 - left_picked).T - ties[right][:, None], k)
+                best[slot] = numpy.concatenate((left_side[0], right_side[0]))
+                choices[slot] = tuple(numpy.concatenate((left_part, right_part)) for (left_part, right_part) in zip(left_side[1:], right_side[1:]))
+
+    # The champion's rows hold the top k for every champion, merge them into one list
+    root = best[0].reshape(-1)
+    order = _top(root[None, :], k)[0]
+    width = best[0].shape[1]
+    likely = [_rebuild(bracket, choices, index // width, index % width) for index in order if root[index] > -numpy.inf]
+    return [(perfect_probability(bracket.with_winners(winners), strategy), winners) for winners in likely]
+
+
+def _rebuild(bracket, choices, champion, rank):
+    """The winners of the rank-th most likely bracket with the champion (an index into the slot's teams) on top"""
+    winners = array('h', [EMPTY]) * bracket.games
+    first_round = bracket.round_slice(1).start
+    stack = [(0, bracket.rounds, champion, rank)]
+    while stack:
+        slot, round_index, local, rank = stack.pop()
+        half = 1 << (round_index - 1)
+        winners[slot] = slot_teams(bracket, round_index, slot)[local]
+        if slot >= first_round:
+            continue
+        opponents, own_ranks, opponent_ranks = choices[slot]
+        own_child, opponent_child = (2 * slot + 1, 2 * slot + 2) if local < half else (2 * slot + 2, 2 * slot + 1)
+        stack.append((own_child, round_index - 1, local % half, own_ranks[local, rank]))
+        stack.append((opponent_child, round_index - 1, opponents[local, rank], opponent_ranks[local, rank]))
+    return winners
+
+
+def best_expected_bracket(bracket, strategy, advancement=None):
+    """
+    The bracket with the highest expected score if every game went the way the
+    strategy picks it: the expected points of picking a team to win a slot are
+    the slot's weight times the chance the strategy advances it that far.
+
+    :param advancement: The strategy's advancement probabilities, if known
+    :return: (expected score, winners)
+    """
+    preference = preference_order(bracket, strategy)
+    if advancement is None:
+        advancement = advancement_probabilities(bracket, strategy)
+    weights = round_weights(bracket)
+    # best[slot][i] is the highest expected score of the slot's subtree with its i-th team picked to win it
+    best = [None] * bracket.games
+    for round_index in range(1, bracket.rounds + 1):
+        round_slice = bracket.round_slice(round_index)
+        for slot in range(round_slice.start, round_slice.stop):
+            teams = slot_teams(bracket, round_index, slot)
+            gains = weights[slot] * advancement[slot, teams]
+            if round_index > 1:
+                left_best, right_best = best[2 * slot + 1], best[2 * slot + 2]
+                gains += numpy.concatenate((left_best + right_best.max(), right_best + left_best.max()))
+            best[slot] = gains
+
+    winners = array('h', [EMPTY]) * bracket.games
+    first_round = bracket.round_slice(1).start
+    stack = [(0, bracket.rounds, _preferred(best[0], preference[slot_teams(bracket, bracket.rounds, 0)]))]
+    while stack:
+        slot, round_index, local = stack.pop()
+        half = 1 << (round_index - 1)
+        winners[slot] = slot_teams(bracket, round_index, slot)[local]
+        if slot >= first_round:
+            continue
+        own_child, opponent_child = (2 * slot + 1, 2 * slot + 2) if local < half else (2 * slot + 2, 2 * slot + 1)
+        stack.append((own_child, round_index - 1, local % half))
+        stack.append((opponent_child, round_index - 1,
+                      _preferred(best[opponent_child], preference[slot_teams(bracket, round_index - 1, opponent_child)])))
+    return float(best[0].max()), winners
+
+
+def describe_odds(probability):
+    return "1 in %.3g" % (1.0 / probability) if probability > 0 else 'never'
+
+
+def main(data_file, years, strategies, top=DEFAULT_TOP, use_cache=True, render_filename=None, render_format='ansi'):
+    rendered_brackets = []
+    for year, tournament_games in load_years(data_file, years, use_cache):
+        actual_bracket = build_actual_bracket(year, tournament_games)
+        weights = round_weights(actual_bracket)
+        log(INFO, "%s\n----", year)
+        log(INFO, "%s %s %s %s %s %s %s", 'STRATEGY'.ljust(JUSTIFICATION_SIZE), 'PERFECT'.rjust(14), 'MOST LIKELY'.rjust(11),
+            'SCORE'.rjust(5), ('TOP %d' % top).rjust(9), 'BEST EXPECTED'.rjust(13), 'SCORE'.rjust(5))
+        for strategy in strategies:
+            likely = most_likely_brackets(actual_bracket, strategy, top)
+            expected_score, expected_winners = best_expected_bracket(actual_bracket, strategy)
+            scores = [int(score_predictions(numpy.asarray(winners, dtype=numpy.int16), actual_bracket, weights)) for (_, winners) in likely]
+            expected_actual = int(score_predictions(numpy.asarray(expected_winners, dtype=numpy.int16), actual_bracket, weights))
+            log(INFO, "%s %s %11.3g %5d %9.3g %13.1f %5d", (strategy.name + ':').ljust(JUSTIFICATION_SIZE),
+                describe_odds(perfect_probability(actual_bracket, strategy)).rjust(14), likely[0][0], scores[0],
+                sum(probability for (probability, _) in likely), expected_score, expected_actual)
+
+            # Brackets are only ever printed at DEBUG, so skip building them otherwise
+            if ncaa_simulations.LOG_LEVEL <= DEBUG:
+                for rank, ((probability, winners), score) in enumerate(zip(likely, scores), 1):
+                    log(DEBUG, "  #%d: %.3g, scoring %d", rank, probability, score)
+                print_as_bracket(actual_bracket.with_winners(likely[0][1]), actual_bracket)
+                print_as_bracket(actual_bracket.with_winners(expected_winners), actual_bracket)
+            if render_filename:
+                for rank, (probability, winners) in enumerate(likely, 1):
+                    rendered_brackets.append(("%d %s #%d (%.3g)" % (year, strategy.name, rank, probability),
+                                              actual_bracket.with_winners(winners), actual_bracket))
+                rendered_brackets.append(("%d %s BEST EXPECTED (%.1f)" % (year, strategy.name, expected_score),
+                                          actual_bracket.with_winners(expected_winners), actual_bracket))
+        log(INFO, "")
+
+    if render_filename:
+        with open(render_filename, 'w', newline='') as render_file:
+            render_all(rendered_brackets, render_file, render_format)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--file", help="The data file to read in", required=True)
+    parser.add_argument("-y", "--years", help="A list of years to find the most likely brackets for", nargs='+', type=int, required=True)
+    parser.add_argument("-k", "--top", help="The number of most likely brackets to find per strategy", type=int, default=DEFAULT_TOP)
+    parser.add_argument("-s", "--seed-history", help="Add the seed history strategies, see ncaa_simulations.py", action="store_true")
+    parser.add_argument("-r", "--render", help="Write the most likely and best expected brackets to a file", dest="render_filename")
+    parser.add_argument("--format", help="The format to write brackets in with --render", choices=FORMATS, default='ansi')
+    parser.add_argument("--no-cache", help="Always parse the data file instead of using its binary cache", dest="use_cache", action="store_false")
+    args = parser.parse_args()
+    if args.top < 1:
+        parser.error("--top must be at least 1")
+
+    strategies = DefaultStrategies.STRATEGIES
+    if args.seed_history:
+        strategies = strategies + seed_history_strategies(SeedHistory.load(args.file))
+    main(args.file, args.years, strategies, args.top, args.use_cache, args.render_filename, args.format)
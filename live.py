@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+"""
+Follows a tournament while it is being played.  Results are read as rows of the
+Game By Game schema (from a file that is appended to, or stdin) and every
+strategy's bracket, along with any number of simulated brackets, is re-scored
+as each one arrives.  A result only touches its own game and the games after
+it, so the cost per result does not depend on how much has been played.
+Results may arrive in any order: one whose earlier games are not in yet is held
+until they are.
+"""
+
+import argparse
+import csv
+import random
+import sys
+import time
+
+from array import array
+
+import numpy
+
+import montecarlo
+from bracket import Bracket, EMPTY
+from datafile import create_reader, read_rows
+from ncaa_simulations import DEBUG, INFO, WARN, JUSTIFICATION_SIZE, build_actual_bracket, load_years, log, perform_predictions
+from schema import Schema
+from strategy import DefaultStrategies
+
+FOLLOW_INTERVAL = 0.5
+FIELD_HEADER = ['Team', 'Seed', 'Region', 'Ranking']
+
+
+def read_field(field_filename):
+    """
+    Reads the teams of a tournament into a blank Bracket.  The field file is a
+    CSV with a header and one (team, seed, region, ranking) row per team in
+    first round order, using a ranking of 0 for unranked teams.
+    """
+    names = []
+    seeds = array('b')
+    rankings = array('h')
+    regions = []
+    with open(field_filename, 'r') as field_file:
+        for row in read_rows(field_file):
+            if len(row) < len(FIELD_HEADER):
+                raise ValueError("Expecting a team, seed, region and ranking, but found %s" % row)
+            names.append(row[0].strip())
+            seeds.append(int(row[1]))
+            regions.append(row[2].strip())
+            rankings.append(int(row[3] or 0))
+    return Bracket(names, seeds, rankings, regions)
+
+
+def write_field(bracket, field_filename):
+    """Writes the teams of a bracket as a field file, see read_field"""
+    with open(field_filename, 'w', newline='') as field_file:
+        writer = csv.writer(field_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(FIELD_HEADER)
+        for team in range(bracket.teams):
+            writer.writerow([bracket.names[team], bracket.seeds[team], bracket.regions[team], bracket.rankings[team]])
+
+
+class LiveTournament:
+    """
+    A partially played tournament and the candidate brackets tracked against
+    it.  Every candidate keeps its current score and the maximum score it can
+    still reach, which are updated in place as results come in.
+
+    :param field: A Bracket holding the teams of the tournament
+    :param candidates: An array of predicted winners with one row per candidate
+                       bracket and one column per slot
+    """
+    def __init__(self, field, candidates):
+        self.actual = field.blank()
+        self.team_indices = dict((name, index) for (index, name) in enumerate(field.names))
+        # One row per slot, so updating a slot reads contiguous memory
+        self.predictions = numpy.ascontiguousarray(numpy.asarray(candidates, dtype=numpy.int16).T)
+        if self.predictions.shape[0] != field.games:
+            raise ValueError("Expecting candidates with %d picks, but found %d" % (field.games, self.predictions.shape[0]))
+        self.weights = montecarlo.round_weights(field)
+        self.current = numpy.zeros(self.predictions.shape[1], dtype=numpy.int32)
+        self.maximum = numpy.full(self.predictions.shape[1], self.weights.sum(), dtype=numpy.int32)
+        self.results = 0
+        # Results waiting for the games before them, by slot
+        self.pending = {}
+        # Held results that turned out not to fit once their earlier games came in, with why
+        self.dropped = []
+
+    def team(self, name):
+        if name not in self.team_indices:
+            raise ValueError("%s is not in the field" % name)
+        return self.team_indices[name]
+
+    def slot_for(self, round_index, team):
+        """The slot in which a team plays its game of a round"""
+        slot = self.actual.first_round_start + team // 2
+        for _ in range(round_index - 1):
+            slot = (slot - 1) // 2
+        return slot
+
+    def could_meet(self, round_index, slot, winner, loser):
+        """Whether two teams can still meet in a slot, from the games before it decided so far"""
+        if round_index == 1 or self.slot_for(round_index, loser) != slot:
+            return False
+        feeders = (self.slot_for(round_index - 1, winner), self.slot_for(round_index - 1, loser))
+        return feeders[0] != feeders[1] and all(self.actual.winners[feeder] in (EMPTY, team) for (feeder, team) in zip(feeders, (winner, loser)))
+
+    def add_result(self, round, winner_name, loser_name):
+        """
+        Records the result of a game, updating the scores of every candidate.
+        Only the game's slot and the slots it leads to are looked at.  A result
+        whose earlier games are not all in yet is held, and recorded once they
+        are, along with any held results that it completes.  A held result that
+        no longer fits is added to dropped instead of failing this one.
+
+        :return: The slot of the game, or None if the result was already known
+                 or is held
+        """
+        if round not in Schema.ROUND_TEAMS or not 1 <= self.actual.round_index(round) <= self.actual.rounds:
+            raise ValueError("Unexpected round %s" % round)
+        round_index = self.actual.round_index(round)
+        winner = self.team(winner_name)
+        loser = self.team(loser_name)
+
+        slot = self.slot_for(round_index, winner)
+        slot_teams = self.actual.slot_teams(slot)
+        if EMPTY in slot_teams and self.could_meet(round_index, slot, winner, loser):
+            held = self.pending.setdefault(slot, (round, winner_name, loser_name))
+            if held != (round, winner_name, loser_name):
+                raise ValueError("Already have %s winning the %s game" % (held[1], round))
+            log(DEBUG, "Holding %s over %s until the games before it are in", winner_name, loser_name)
+            return None
+        if sorted((winner, loser)) != sorted(slot_teams):
+            raise ValueError("%s and %s do not meet in the %s" % (winner_name, loser_name, round))
+        if self.actual.winners[slot] == winner:
+            return None
+        if self.actual.winners[slot] != EMPTY:
+            raise ValueError("Already have %s winning the %s game" % (self.actual.names[self.actual.winners[slot]], round))
+
+        self.actual.set_winner(slot, winner)
+        self.results += 1
+        self.current += self.weights[slot] * (self.predictions[slot] == winner)
+
+        # The loser can no longer win this game, or any of the games after it
+        next_slot = slot
+        while True:
+            self.maximum -= self.weights[next_slot] * (self.predictions[next_slot] == loser)
+            if next_slot == 0:
+                break
+            next_slot = (next_slot - 1) // 2
+
+        next_slot = (slot - 1) // 2
+        if slot != 0 and next_slot in self.pending and EMPTY not in self.actual.slot_teams(next_slot):
+            held = self.pending.pop(next_slot)
+            try:
+                self.add_result(*held)
+            except ValueError as error:
+                self.dropped.append((held, error))
+        return slot
+
+    def add_row(self, row):
+        """Records a result given as a row of the Game By Game schema"""
+        if row[Schema.WINS].strip() != '0' or row[Schema.LOSSES].strip() != '1':
+            raise ValueError("Encountered unexpected win/loss entry %s" % row)
+        return self.add_result(row[Schema.ROUND].strip(), row[Schema.OPPONENT].strip(), row[Schema.TEAM].strip())
+
+
+def build_candidates(field, strategies, samples):
+    """
+    The brackets to track for every strategy: the one it predicts from its seed,
+    followed by a number of simulated ones.
+
+    :return: The candidates as an array with one row per bracket, and the slice
+             of rows belonging to each strategy
+    """
+    candidates = []
+    groups = []
+    for strategy in strategies:
+        predicted_bracket = field.blank()
+        perform_predictions(predicted_bracket, strategy, random.Random(strategy.seed))
+        start = sum(len(rows) for rows in candidates)
+        candidates.append(numpy.asarray(predicted_bracket.winners, dtype=numpy.int16)[numpy.newaxis, :])
+        if samples:
+            tosses = numpy.random.default_rng(strategy.seed).random((samples, field.games))
+            candidates.append(montecarlo.simulate_predictions(field, strategy, tosses))
+        groups.append((strategy, slice(start, start + 1 + samples)))
+    return numpy.concatenate(candidates), groups
+
+
+def print_standings(tournament, groups):
+    log(INFO, "%s %s %s", ('AFTER %d GAMES' % tournament.results).ljust(JUSTIFICATION_SIZE), 'SCORE'.rjust(5), 'MAX'.rjust(5))
+    for strategy, rows in groups:
+        line = "%s %5d %5d" % ((strategy.name + ':').ljust(JUSTIFICATION_SIZE), tournament.current[rows.start], tournament.maximum[rows.start])
+        if rows.stop - rows.start > 1:
+            simulated = slice(rows.start + 1, rows.stop)
+            line += "\tSIMULATED MEAN: %2.1f\tBEST: %d\tBEST MAX: %d" % (
+                tournament.current[simulated].mean(), tournament.current[simulated].max(), tournament.maximum[simulated].max()
+            )
+        log(INFO, line)
+
+
+class LineReader:
+    """
+    The complete lines of a file that keeps getting appended to.  A partial
+    last line is held back until the rest of it is written, including between
+    catching up and following.
+    """
+    def __init__(self, results_file):
+        self.results_file = results_file
+        self.pending = ''
+
+    def available(self):
+        """Yields the complete lines written so far"""
+        while True:
+            line = self.results_file.readline()
+            if not line:
+                return
+            self.pending += line
+            if self.pending.endswith('\n'):
+                yield self.pending
+                self.pending = ''
+
+    def follow(self):
+        """Yields complete lines as they are appended, forever"""
+        while True:
+            yield from self.available()
+            time.sleep(FOLLOW_INTERVAL)
+
+
+def apply_lines(tournament, lines, groups=None, strict=False):
+    """
+    Records every result in some lines of the Game By Game schema, skipping the
+    header, play-in games and any bad rows.  With groups, the standings are
+    printed after every new result.  With strict, a result that cannot be
+    recorded is an error instead of a warning.
+    """
+    for line in lines:
+        row = next(create_reader([line]), None)
+        if not row or len(row) <= Schema.LOSSES or (row[Schema.ROUND].strip() not in Schema.ROUND_TEAMS and row[Schema.ROUND].strip() != Schema.OPENING_ROUND):
+            log(DEBUG, "Skipping %s", line.rstrip())
+            continue
+        if row[Schema.ROUND].strip() == Schema.OPENING_ROUND:
+            continue
+
+        start = time.perf_counter()
+        try:
+            slot = tournament.add_row(row)
+        except ValueError as error:
+            if strict:
+                raise ValueError("Cannot record result %s: %s" % (line.rstrip(), error))
+            log(WARN, "Skipping result %s: %s", line.rstrip(), error)
+            continue
+        elapsed = time.perf_counter() - start
+
+        while tournament.dropped:
+            (round, winner, loser), error = tournament.dropped.pop(0)
+            if strict:
+                raise ValueError("Cannot record the held result of %s over %s in the %s: %s" % (winner, loser, round, error))
+            log(WARN, "Dropping the held result of %s over %s in the %s: %s", winner, loser, round, error)
+
+        if slot is not None and groups is not None:
+            log(INFO, "\n%s: %s OVER %s (%.3fms)", row[Schema.ROUND].strip(), row[Schema.OPPONENT].strip(), row[Schema.TEAM].strip(), 1000 * elapsed)
+            print_standings(tournament, groups)
+
+
+def describe_pending(tournament):
+    return ', '.join("%s over %s in the %s" % (winner, loser, round) for (round, winner, loser) in tournament.pending.values())
+
+
+def main(field, strategies, results_filename=None, follow=False, samples=0):
+    candidates, groups = build_candidates(field, strategies, samples)
+    tournament = LiveTournament(field, candidates)
+
+    if results_filename is None:
+        apply_lines(tournament, sys.stdin, groups)
+        return
+
+    with open(results_filename, 'r') as results_file:
+        # Catch up on the results so far, then wait for more to be appended
+        lines = LineReader(results_file)
+        apply_lines(tournament, lines.available())
+        if not follow and lines.pending:
+            # Nothing more is coming, so a last line without a newline is complete
+            apply_lines(tournament, [lines.pending])
+        if tournament.pending:
+            log(WARN, "Waiting for the games before %s", describe_pending(tournament))
+        print_standings(tournament, groups)
+        if follow:
+            apply_lines(tournament, lines.follow(), groups)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--field", help="A field file listing the teams (team, seed, region, ranking) in first round order")
+    parser.add_argument("-f", "--file", help="A data file to take the field from instead, along with --year")
+    parser.add_argument("-y", "--year", help="The year of the data file to take the field from", type=int)
+    parser.add_argument("--save-field", help="Where to write the field as a field file")
+    parser.add_argument("-r", "--results", help="A file of results so far in the Game By Game schema (stdin if not given)")
+    parser.add_argument("--follow", help="Keep reading results as they are appended to the results file", action="store_true")
+    parser.add_argument("-n", "--samples", help="The number of simulated brackets to track per strategy", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.field:
+        field = read_field(args.field)
+    elif args.file and args.year:
+        (year, tournament_games), = load_years(args.file, [args.year])
+        field = build_actual_bracket(year, tournament_games).blank()
+    else:
+        parser.error("either --field or --file and --year are required")
+
+    if args.save_field:
+        write_field(field, args.save_field)
+    else:
+        main(field, DefaultStrategies.STRATEGIES, args.results, args.follow, args.samples)
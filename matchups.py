@@ -0,0 +1,102 @@
+"""
+Precomputed team x team tables for a tournament: which team is the favorite
+when any two teams meet, and how likely each is to win under a probability
+model.  A table is built once per year and shared, read-only, by every copy of
+its bracket, every strategy and every worker process.
+"""
+
+from array import array
+
+NO_FAVORITE = -1
+
+
+class FavoriteBias:
+    """
+    A probability model in which the favorite wins every game with the same
+    probability.  Like every model it is called with a bracket, the favorite
+    and the underdog, and returns the probability of the favorite winning.
+    Two teams can only ever meet in one round, (favorite ^ underdog).bit_length().
+
+    :param bias: The probability of the favorite winning
+    """
+    def __init__(self, bias):
+        self.bias = bias
+
+    def __call__(self, bracket, favorite, underdog):
+        return self.bias
+
+    def __repr__(self):
+        return "FavoriteBias(%s)" % self.bias
+
+
+class MatchupTable:
+    """
+    The favorite of every possible game between two teams of a bracket, as
+    decided by Bracket.favorite, stored densely so the inner loops only index
+    into it.  Tables of win probabilities are added per model on first use.
+
+    :param bracket: The bracket whose teams (seeds and rankings) to use
+    """
+    def __init__(self, bracket):
+        self.teams = bracket.teams
+
+        # favorites[left * teams + right] is the favorite when left (the upper
+        # team) meets right in a later round, or NO_FAVORITE if it cannot be told
+        self.favorites = array('h', [NO_FAVORITE]) * (self.teams * self.teams)
+        for left in range(self.teams):
+            for right in range(self.teams):
+                if left == right:
+                    continue
+                try:
+                    self.favorites[left * self.teams + right] = bracket.favorite(left, right)[0]
+                except ValueError:
+                    pass
+
+        # Ties in the first round go to the upper team, so its games are kept apart
+        self.first_round_favorites = array('h', (
+            bracket.favorite(left, left + 1, first_round=True)[0] for left in range(0, self.teams, 2)
+        ))
+        self.bracket = bracket
+        self._probabilities = {}
+
+    def favorite(self, left, right, first_round=False):
+        """The same as Bracket.favorite, from the table"""
+        if first_round:
+            favorite = self.first_round_favorites[left // 2]
+        else:
+            favorite = self.favorites[left * self.teams + right]
+            if favorite == NO_FAVORITE:
+                raise ValueError("Inception")
+        return (left, right) if favorite == left else (right, left)
+
+    def probabilities(self, model):
+        """
+        The table of win probabilities under a model: entry left * teams + right
+        is the probability of left beating right in a later round.  Built once
+        per model and then shared.
+        """
+        return self._tables_for(model)[0]
+
+    def first_round_probabilities(self, model):
+        """The probability of every first round game's upper team winning it under a model"""
+        return self._tables_for(model)[1]
+
+    def _tables_for(self, model):
+        if model not in self._probabilities:
+            probabilities = array('d', [0.5]) * (self.teams * self.teams)
+            for left in range(self.teams):
+                for right in range(self.teams):
+                    favorite = self.favorites[left * self.teams + right]
+                    if favorite != NO_FAVORITE:
+                        probabilities[left * self.teams + right] = self._left_wins(model, left, right, favorite)
+
+            first_round_probabilities = array('d', (
+                self._left_wins(model, left, left + 1, self.first_round_favorites[left // 2]) for left in range(0, self.teams, 2)
+            ))
+            self._probabilities[model] = (probabilities, first_round_probabilities)
+        return self._probabilities[model]
+
+    def _left_wins(self, model, left, right, favorite):
+        underdog = right if favorite == left else left
+        favorite_wins = model(self.bracket, favorite, underdog)
+        return favorite_wins if favorite == left else 1.0 - favorite_wins
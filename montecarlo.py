@@ -0,0 +1,211 @@
+"""
+Vectorized Monte Carlo evaluation of a Strategy.  Rather than producing a single
+predicted bracket from one seed, this simulates a large batch of predicted
+brackets at once and reports the distribution of their scores.
+"""
+
+import numpy
+
+from bracket import EMPTY
+from matchups import NO_FAVORITE
+
+# How many picks (brackets times games) are held in memory at once
+DEFAULT_BATCH_CELLS = 6300000
+
+
+class ScoreDistribution:
+    """
+    The scores of a set of simulated brackets against the actual bracket.
+
+    :param scores: One score per simulated bracket
+    """
+    def __init__(self, scores):
+        self.scores = scores
+
+    @property
+    def samples(self):
+        return len(self.scores)
+
+    @property
+    def mean(self):
+        return float(numpy.mean(self.scores))
+
+    @property
+    def variance(self):
+        return float(numpy.var(self.scores))
+
+    @property
+    def stdev(self):
+        return float(numpy.std(self.scores))
+
+    def percentile(self, percent):
+        return float(numpy.percentile(self.scores, percent))
+
+    def __str__(self):
+        return "MEAN: %2.1f\tSTDEV: %2.1f\tP5: %2.1f\tP50: %2.1f\tP95: %2.1f\t(%d samples)" % (
+            self.mean,
+            self.stdev,
+            self.percentile(5),
+            self.percentile(50),
+            self.percentile(95),
+            self.samples
+        )
+
+
+def round_weights(bracket):
+    """The points awarded for correctly picking each slot of a bracket"""
+    weights = numpy.empty(bracket.games, dtype=numpy.int32)
+    for round_index in range(1, bracket.rounds + 1):
+        weights[bracket.round_slice(round_index)] = pow(2, round_index - 1)
+    return weights
+
+
+def favorite_teams(matchups, left, right, first_round):
+    """
+    The vectorized form of Bracket.favorite: the favorite of each left team and
+    the right team it is paired with, looked up in the bracket's MatchupTable.
+
+    :param matchups: The MatchupTable of the bracket
+    :param left: Array of left (upper) team indices
+    :param right: Array of right (lower) team indices, the same shape as left
+    """
+    if first_round:
+        return numpy.frombuffer(matchups.first_round_favorites, dtype=numpy.int16)[left // 2]
+
+    favorites = numpy.frombuffer(matchups.favorites, dtype=numpy.int16).reshape(matchups.teams, matchups.teams)[left, right]
+    if numpy.any(favorites == NO_FAVORITE):
+        raise ValueError("Inception")
+    return favorites
+
+
+def left_win_probabilities(matchups, model, left, right, first_round):
+    """
+    The probability of each left team beating the right team it is paired
+    with under a probability model, looked up in the bracket's MatchupTable.
+    """
+    if first_round:
+        return numpy.frombuffer(matchups.first_round_probabilities(model))[left // 2]
+    return numpy.frombuffer(matchups.probabilities(model)).reshape(matchups.teams, matchups.teams)[left, right]
+
+
+def simulate_predictions(bracket, strategy, tosses, decided_bracket=None):
+    """
+    Runs the strategy's picks for a batch of brackets at once.
+
+    :param bracket: The bracket being predicted (only its teams are used)
+    :param strategy: The Strategy making the picks
+    :param tosses: An array of coin tosses in [0, 1) with one row per simulated
+                   bracket and one column per slot
+    :param decided_bracket: A partially played bracket whose decided games are
+                            kept as they are instead of being picked
+    :return: An array of winning team indices with the same shape as tosses
+    """
+    samples = tosses.shape[0]
+    seeds = numpy.asarray(bracket.seeds, dtype=numpy.int16)
+    matchups = bracket.matchups
+    winners = numpy.empty((samples, bracket.games), dtype=numpy.int16)
+
+    for round_index in range(1, bracket.rounds + 1):
+        round_slice = bracket.round_slice(round_index)
+        if round_index == 1:
+            left = numpy.broadcast_to(numpy.arange(0, bracket.teams, 2, dtype=numpy.int16), (samples, bracket.teams // 2))
+            right = left + 1
+        else:
+            previous_winners = winners[:, 2 * round_slice.start + 1:2 * round_slice.stop + 1]
+            left = previous_winners[:, 0::2]
+            right = previous_winners[:, 1::2]
+
+        favorites = favorite_teams(matchups, left, right, round_index == 1)
+        underdogs = numpy.where(favorites == left, right, left)
+
+        number_protected = 0
+        if strategy.protected_function:
+            number_protected = strategy.protected_function(bracket.round_name(round_index))
+
+        favorite_bias = strategy.favorite_bias
+        if strategy.model:
+            left_wins = left_win_probabilities(matchups, strategy.model, left, right, round_index == 1)
+            favorite_bias = numpy.where(favorites == left, left_wins, 1.0 - left_wins)
+
+        upsets = (tosses[:, round_slice] > favorite_bias) & (seeds[favorites] > number_protected)
+        round_winners = numpy.where(upsets, underdogs, favorites)
+        if decided_bracket is not None:
+            decided_winners = numpy.asarray(decided_bracket.round_winners(round_index), dtype=numpy.int16)
+            round_winners = numpy.where(decided_winners != EMPTY, decided_winners, round_winners)
+        winners[:, round_slice] = round_winners
+
+    return winners
+
+
+def simulate_results(bracket, model, tosses, decided_bracket=None):
+    """
+    Simulates how the games of a bracket turn out under a probability model
+    (see matchups.py), for a batch of brackets at once.
+
+    :param bracket: The bracket being simulated (only its teams are used)
+    :param model: The probability model deciding each game
+    :param tosses: An array of draws in [0, 1) with one row per simulated
+                   bracket and one column per slot
+    :param decided_bracket: A partially played bracket whose decided games are
+                            kept as they are
+    :return: An array of winning team indices with the same shape as tosses
+    """
+    samples = tosses.shape[0]
+    matchups = bracket.matchups
+    winners = numpy.empty((samples, bracket.games), dtype=numpy.int16)
+
+    for round_index in range(1, bracket.rounds + 1):
+        round_slice = bracket.round_slice(round_index)
+        if round_index == 1:
+            left = numpy.broadcast_to(numpy.arange(0, bracket.teams, 2, dtype=numpy.int16), (samples, bracket.teams // 2))
+            right = left + 1
+        else:
+            previous_winners = winners[:, 2 * round_slice.start + 1:2 * round_slice.stop + 1]
+            left = previous_winners[:, 0::2]
+            right = previous_winners[:, 1::2]
+
+        left_wins = left_win_probabilities(matchups, model, left, right, round_index == 1)
+        round_winners = numpy.where(tosses[:, round_slice] < left_wins, left, right)
+        if decided_bracket is not None:
+            decided_winners = numpy.asarray(decided_bracket.round_winners(round_index), dtype=numpy.int16)
+            round_winners = numpy.where(decided_winners != EMPTY, decided_winners, round_winners)
+        winners[:, round_slice] = round_winners
+
+    return winners
+
+
+def score_predictions(predicted_winners, actual_bracket, weights=None):
+    """Scores every row of an array of predicted winners against the actual bracket"""
+    if weights is None:
+        weights = round_weights(actual_bracket)
+    actual_winners = numpy.asarray(actual_bracket.winners, dtype=numpy.int16)
+    return (predicted_winners == actual_winners).astype(numpy.int32) @ weights
+
+
+def evaluate_strategy(actual_bracket, strategy, samples, rng=None, batch_size=None):
+    """
+    Simulates a number of predicted brackets for a strategy and scores them.
+
+    :param actual_bracket: The bracket that actually happened
+    :param strategy: The Strategy making the picks
+    :param samples: The number of brackets to simulate
+    :param rng: A numpy Generator to draw coin tosses from (seeded from the
+                strategy if not given)
+    :param batch_size: The maximum number of brackets held in memory at once,
+                       by default as many as fit DEFAULT_BATCH_CELLS picks
+    :return: The ScoreDistribution of the simulated brackets
+    """
+    if rng is None:
+        rng = numpy.random.default_rng(strategy.seed)
+
+    if batch_size is None:
+        batch_size = max(1, DEFAULT_BATCH_CELLS // actual_bracket.games)
+
+    weights = round_weights(actual_bracket)
+    scores = numpy.empty(samples, dtype=numpy.int32)
+    for start in range(0, samples, batch_size):
+        count = min(batch_size, samples - start)
+        tosses = rng.random((count, actual_bracket.games))
+        predicted_winners = simulate_predictions(actual_bracket, strategy, tosses)
+        scores[start:start + count] = score_predictions(predicted_winners, actual_bracket, weights)
+    return ScoreDistribution(scores)
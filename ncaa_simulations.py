@@ -5,30 +5,32 @@ Some simulations for NCAA March Madness.
 """
 
 import argparse
-import csv
+import json
 import operator
 import random
 import statistics
 import sys
+import time
 
-from collections import deque
+import numpy
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from queue import PriorityQueue
 
 from schema import Schema
 from strategy import Strategy, DefaultStrategies
 from game import Game
-
-TOTAL_TEAMS = 64
-MAX_SCORE = (TOTAL_TEAMS / 2) * (len(Schema.ORDERED_ROUNDS) - 1)
-
-COLOR_FORMAT = "\033[%dm"
-COLOR_ENDING = "\033[0m"
-JUSTIFICATION_SIZE = 33
-EMPTY_SPACE = ''.ljust(JUSTIFICATION_SIZE)
-TEAM_HEADER = '|_ '
-LOSS_COLOR = 31
-WIN_COLOR = 32
-NEUTRAL_COLOR = 0
+from bracket import Bracket, round_index
+from matchups import NO_FAVORITE
+from datafile import ColumnCache, read_rows, read_years
+from seedhistory import SeedHistory, seed_history_strategies
+from store import ResultStore
+from render import FORMATS, JUSTIFICATION_SIZE, EMPTY_SPACE, render_all, render_ansi
+from timing import PhaseTimer
+import analytic
+import montecarlo
 
 (
     TRACE,
@@ -39,265 +41,171 @@ NEUTRAL_COLOR = 0
 ) = range(5)
 LOG_LEVEL = INFO
 
+# The PhaseTimer collecting per-phase timings, or None when not profiling
+TIMER = None
+_NOT_TIMED = nullcontext()
+
 
-def log(level, log_msg):
+def log(level, log_msg, *args):
+    """
+    Prints a message if its level is enabled.  Any arguments are only
+    %-formatted into the message once it is known to be printed.
+    """
     if level >= LOG_LEVEL:
-        print(log_msg)
+        print(log_msg % args if args else log_msg)
+
+
+def timed(phase, year=None, strategy=None):
+    """Times a block as a phase when profiling, otherwise does nothing"""
+    if TIMER is None:
+        return _NOT_TIMED
+    return TIMER.phase(phase, year, strategy)
+
+
+def round_winner_names_in_game_order(bracket, round_index):
+    """
+    The names of the winners of a round in the order the linked Game tree
+    listed them: depth first from the championship, the side of each game's
+    loser before the side of its winner.
+    """
+    names = []
+    to_search = [0]
+    while to_search:
+        slot = to_search.pop()
+        winner = bracket.winners[slot]
+        if bracket.round_of(slot) == round_index:
+            names.append(bracket.names[winner])
+            continue
+        winner_slot, loser_slot = (2 * slot + 1, 2 * slot + 2) if bracket.winners[2 * slot + 1] == winner else (2 * slot + 2, 2 * slot + 1)
+        to_search.append(winner_slot)
+        to_search.append(loser_slot)
+    return names
 
 
 def compute_score(predicted_bracket, actual_bracket, strategy):
     if not actual_bracket or not predicted_bracket:
         raise ValueError("Received a null predicted or actual bracket")
 
-    total_score = 0
-    round_information = {}
-    for round_index in range(1, len(Schema.ORDERED_ROUNDS)):
-        round = Schema.ORDERED_ROUNDS[round_index]
-
-        predicted_winners = [game.winner_name for game in get_round_games(predicted_bracket, round)]
-        actual_winners = [game.winner_name for game in get_round_games(actual_bracket, round)]
-        overlap_winners = [winner for winner in predicted_winners if winner in actual_winners]
+    if predicted_bracket.names is not actual_bracket.names:
+        raise ValueError("Predicted and actual brackets do not share their teams")
 
+    total_score = 0
+    round_scores = []
+    for round_index in range(1, actual_bracket.rounds + 1):
+        overlap_winners = predicted_bracket.round_winner_set(round_index) & actual_bracket.round_winner_set(round_index)
         round_score = pow(2, round_index - 1) * len(overlap_winners)
+        round_scores.append(round_score)
         total_score += round_score
 
-        round_information[round] = {
-            'score': round_score,
-            'predicted': predicted_winners,
-            'actual': actual_winners,
-            'intersection': overlap_winners
-        }
+    log(INFO, "%s %d/%d", (strategy.name + ':').ljust(JUSTIFICATION_SIZE), total_score, actual_bracket.max_score)
+    if LOG_LEVEL > DEBUG:
+        return total_score
 
-    log(INFO, "%s %d/%d" % ((strategy.name + ':').ljust(JUSTIFICATION_SIZE), total_score, MAX_SCORE))
-    log(DEBUG,
+    if strategy.model:
+        log(DEBUG,
+"""
+  SEED = %d
+  MODEL = %s
+  PROTECTED_FUN = %s
+""", strategy.seed, strategy.model, strategy.protected_function)
+    else:
+        log(DEBUG,
 """
   SEED = %d
   FAVORITE_BIAS = %f
   PROTECTED_FUN = %s
-""" % (strategy.seed, strategy.favorite_bias, strategy.protected_function))
+""", strategy.seed, strategy.favorite_bias, strategy.protected_function)
 
-    for round_index in range(1, len(Schema.ORDERED_ROUNDS)):
-        round = Schema.ORDERED_ROUNDS[round_index]
-        information = round_information[round]
-        log(DEBUG, "    %s: %d" % (round, information['score']))
+    for round_index in range(1, actual_bracket.rounds + 1):
+        predicted_winners = round_winner_names_in_game_order(predicted_bracket, round_index)
+        actual_winners = round_winner_names_in_game_order(actual_bracket, round_index)
+        actual_winner_names = actual_bracket.round_winner_names(round_index)
+        log(DEBUG, "    %s: %d", actual_bracket.round_name(round_index), round_scores[round_index - 1])
         log(DEBUG,
 """      PREDICTED: %s
       ACTUAL: %s
-      INTERSECTION: %s""" % (information['predicted'], information['actual'], information['intersection']))
+      INTERSECTION: %s""", predicted_winners, actual_winners, [winner for winner in predicted_winners if winner in actual_winner_names])
 
     return total_score
 
-def perform_predictions(game, strategy, season_rankings):
-    if not game:
-        return
-
-    perform_predictions(game.winner_previous_game, strategy, season_rankings)
-    perform_predictions(game.loser_previous_game, strategy, season_rankings)
-
-    # Hack for opening round games
-    if not game.winner_previous_game:
-        favorite_game = Game(Schema.ORDERED_ROUNDS[Schema.ROUND_ORDER[game.round] - 1], None, 1, None, game.winner_name, game.winner_seed, game.winner_region, None, None, None)
-        underdog_game = Game(Schema.ORDERED_ROUNDS[Schema.ROUND_ORDER[game.round] - 1], None, 1, None, game.loser_name, game.loser_seed, game.loser_region, None, None, None)
-
-    elif game.winner_previous_game.winner_seed < game.loser_previous_game.winner_seed:
-        favorite_game = game.winner_previous_game
-        underdog_game = game.loser_previous_game
-    elif game.winner_previous_game.winner_seed > game.loser_previous_game.winner_seed:
-        favorite_game = game.loser_previous_game
-        underdog_game = game.winner_previous_game
-    else:
-        winner_previous_ranking = int(season_rankings[game.winner_previous_game.winner_name])
-        loser_previous_ranking = int(season_rankings[game.loser_previous_game.winner_name])
-
-        if winner_previous_ranking == 0 and loser_previous_ranking == 0:
-            # BOTH UNRANKED TEAMS... PICK THE LEFT ONE
-            favorite_game = game.winner_previous_game
-            underdog_game = game.loser_previous_game
-        elif (winner_previous_ranking > loser_previous_ranking) or winner_previous_ranking == 0:
-            favorite_game = game.loser_previous_game
-            underdog_game = game.winner_previous_game
-        elif (loser_previous_ranking > winner_previous_ranking) or loser_previous_ranking == 0:
-            favorite_game = game.winner_previous_game
-            underdog_game = game.loser_previous_game
-        else:
-            raise ValueError("Inception")
-
-    # PICK THE CHOSEN ONES
-    number_protected = 0
-    if strategy.protected_function:
-        number_protected = strategy.protected_function(game.round)
-
-    # PERFORM THE COIN TOSS
-    coin_toss = random.random()
-    winner = favorite_game
-    loser = underdog_game
-    if favorite_game.winner_seed <= number_protected:
-        log(DEBUG,
-                "PROTECTED %s: %s [%d] OVER %s [%d]" %
-                (game.round, favorite_game.winner_name, favorite_game.winner_seed, underdog_game.winner_name, underdog_game.winner_seed)
-        )
-    elif coin_toss > strategy.favorite_bias:
-        log(DEBUG,
-                "UPSET %s: %s [%d] OVER %s [%d]" %
-                (game.round, underdog_game.winner_name, underdog_game.winner_seed, favorite_game.winner_name, favorite_game.winner_seed)
-        )
-        winner = underdog_game
-        loser = favorite_game
-
-    if game.winner_previous_game:
-        game.winner_previous_game = winner
-    game.winner_name = winner.winner_name
-    game.winner_seed = winner.winner_seed
-    game.winner_region = winner.winner_region
-    if game.loser_previous_game:
-        game.loser_previous_game = loser
-    game.loser_name = loser.winner_name
-    game.loser_seed = loser.winner_seed
-    game.loser_region = loser.winner_region
-
-
-def wipe_game_recursively(game):
-    if game.round == Schema.ROUND_OF_64:
-        if game.loser_seed < game.winner_seed:
-            favorite_name = game.loser_name
-            favorite_seed = game.loser_seed
-            favorite_region = game.loser_region
-            game.loser_name = game.winner_name
-            game.loser_seed = game.winner_seed
-            game.loser_region = game.winner_region
-            game.winner_name = favorite_name
-            game.winner_seed = favorite_seed
-            game.winner_region = favorite_region
-        return
-
-    wipe_game_recursively(game.winner_previous_game)
-    wipe_game_recursively(game.loser_previous_game)
-    game.winner_name = game.winner_seed = game.winner_region = game.loser_name = game.loser_seed = game.loser_region = ''
-
-
-def deep_copy(game):
-    if game is None:
-        return None
-
-
-    clone_game = Game(
-        game.round,
-        game.loser_name,
-        game.loser_seed,
-        game.loser_region,
-        game.winner_name,
-        game.winner_seed,
-        game.winner_region,
-        None,
-        None,
-        None
-    )
-
-    winner_previous_game = deep_copy(game.winner_previous_game)
-    if winner_previous_game:
-        clone_game.winner_previous_game = winner_previous_game
-        clone_game.winner_previous_game.next_game = clone_game
-
-    loser_previous_game = deep_copy(game.loser_previous_game)
-    if loser_previous_game:
-        clone_game.loser_previous_game = loser_previous_game
-        clone_game.loser_previous_game.next_game = clone_game
-
-    return clone_game
-
-
-def get_round_games(bracket_root, round):
-    to_search = deque([bracket_root])
-    collected = []
-    while True:
-        try:
-            next_game = to_search.pop()
-            if next_game.round == round:
-                collected.append(next_game)
-                continue
-            if next_game.winner_previous_game:
-                to_search.append(next_game.winner_previous_game)
-            if next_game.loser_previous_game:
-                to_search.append(next_game.loser_previous_game)
-        except IndexError:
-            break
-    return collected
-
-
-def create_decorated_string(team, ranking, color):
-    decorated_string = "%s [%s] " % (team, ranking)
-    padding = '_' * (JUSTIFICATION_SIZE - len(decorated_string) - len(TEAM_HEADER))
-    color_string = COLOR_FORMAT % color
-    decorated_string = TEAM_HEADER + color_string + decorated_string + COLOR_ENDING + padding
-    return decorated_string
-
-
-def determine_print_color(team_name, previous_round_winners):
-    if not previous_round_winners:
-        return NEUTRAL_COLOR
-    if team_name in previous_round_winners:
-        return WIN_COLOR
-    return LOSS_COLOR
-
-
-def print_as_bracket(bracket_root, actual_root=None):
-    validate_championship_game(bracket_root)
-
-    # Initialize your output with the national champion (not represented in the dataset)
-    national_championship_winner = []
-    if actual_root:
-        national_championship_winner = [actual_root.winner_name]
-    national_champion_color = determine_print_color(bracket_root.winner_name, national_championship_winner)
-
-    national_champion_output = []
-    national_champion_output.extend([EMPTY_SPACE] * (pow(2, Schema.ROUND_ORDER[Schema.NATIONAL_CHAMPIONSHIP]) - 1))
-    national_champion_output.append(create_decorated_string(bracket_root.winner_name, bracket_root.winner_seed, national_champion_color))
-    national_champion_output.extend([EMPTY_SPACE] * (pow(2, Schema.ROUND_ORDER[Schema.NATIONAL_CHAMPIONSHIP]) - 1))
-    total_output = [national_champion_output]
-
-    # Walk the graph from national championship game out to the branches (round of 64)
-    current_games = [bracket_root]
-    next_games = []
-    while current_games:
-        # Used to match up predicted with actual.  I know this is slow, but whatever
-        previous_round_winners = []
-        if actual_root and Schema.ROUND_ORDER[current_games[0].round] > 1:
-            previous_round = current_games[0].winner_previous_game.round
-            previous_round_winners = [game.winner_name for game in get_round_games(actual_root, previous_round)]
-
-        my_output = deque([])
-        for game in current_games:
-            winner_color = determine_print_color(game.winner_name, previous_round_winners)
-            my_output.append(create_decorated_string(game.winner_name, game.winner_seed, winner_color))
-            my_output.extend([EMPTY_SPACE] * (pow(2, Schema.ROUND_ORDER[game.round]) - 1))
-            if game.winner_previous_game:
-                next_games.append(game.winner_previous_game)
-
-            loser_color = determine_print_color(game.loser_name, previous_round_winners)
-            my_output.append(create_decorated_string(game.loser_name, game.loser_seed, loser_color))
-            my_output.extend([EMPTY_SPACE] * (pow(2, Schema.ROUND_ORDER[game.round]) - 1))
-            if game.loser_previous_game:
-                next_games.append(game.loser_previous_game)
-
-        # Perform a shift so they align in a diamond-ish shape
-        my_output.rotate(pow(2, Schema.ROUND_ORDER[game.round] - 1) - 1)
-        total_output.append(my_output)
-
-        # Move onto the next list of games (if there are any in the previous round)
-        current_games = next_games
-        next_games = []
-
-    # Write vertical representation out horizontally (assumes all vertical slices are same size)
-    for index in range(len(total_output[0])):
-        horizontal_slice = ''
-        for inner_index in range(len(total_output)):
-            horizontal_slice += total_output[inner_index][index]
-        log(DEBUG, horizontal_slice)
-
-
-def validate_championship_game(game):
-    if game.round != Schema.NATIONAL_CHAMPIONSHIP:
-        raise ValueError("Expecting national championship game, but found %s" % game.round)
+def perform_predictions(bracket, strategy, rng):
+    """
+    Picks every game of a blank bracket, one round at a time from the first.
+    Coin tosses are drawn up front and handed out in the order a depth-first
+    walk of the bracket would consume them, so a given seed always produces
+    the same bracket.  Favorites come from the bracket's shared MatchupTable.
+    """
+    tosses = [rng.random() for _ in range(bracket.games)]
+    toss_order = bracket.toss_order
+    winners = bracket.winners
+    seeds = bracket.seeds
+    teams = bracket.teams
+    favorites = bracket.matchups.favorites
+    first_round_favorites = bracket.matchups.first_round_favorites
+    favorite_bias = strategy.favorite_bias
+    debug = LOG_LEVEL <= DEBUG
+
+    # With a model the favorite's chance comes from its table, game by game
+    model_probabilities = first_round_probabilities = None
+    if strategy.model:
+        model_probabilities = bracket.matchups.probabilities(strategy.model)
+        first_round_probabilities = bracket.matchups.first_round_probabilities(strategy.model)
+
+    for round_index in range(1, bracket.rounds + 1):
+        round = bracket.round_name(round_index)
+        round_slice = bracket.round_slice(round_index)
+        first_round = round_index == 1
+
+        # PICK THE CHOSEN ONES
+        number_protected = 0
+        if strategy.protected_function:
+            number_protected = strategy.protected_function(round)
+
+        for slot in range(round_slice.start, round_slice.stop):
+            if first_round:
+                left = 2 * (slot - round_slice.start)
+                right = left + 1
+                favorite = first_round_favorites[slot - round_slice.start]
+            else:
+                left = winners[2 * slot + 1]
+                right = winners[2 * slot + 2]
+                favorite = favorites[left * teams + right]
+                if favorite == NO_FAVORITE:
+                    raise ValueError("Inception")
+            underdog = right if favorite == left else left
+            if model_probabilities is not None:
+                if first_round:
+                    left_wins = first_round_probabilities[slot - round_slice.start]
+                else:
+                    left_wins = model_probabilities[left * teams + right]
+                favorite_bias = left_wins if favorite == left else 1.0 - left_wins
+
+            # PERFORM THE COIN TOSS
+            winner = favorite
+            if seeds[favorite] <= number_protected:
+                if debug:
+                    log(DEBUG,
+                            "PROTECTED %s: %s [%d] OVER %s [%d]",
+                            round, bracket.names[favorite], seeds[favorite], bracket.names[underdog], seeds[underdog]
+                    )
+            elif tosses[toss_order[slot]] > favorite_bias:
+                if debug:
+                    log(DEBUG,
+                            "UPSET %s: %s [%d] OVER %s [%d]",
+                            round, bracket.names[underdog], seeds[underdog], bracket.names[favorite], seeds[favorite]
+                    )
+                winner = underdog
+            winners[slot] = winner
+
+    bracket.reindex()
+
+
+def print_as_bracket(bracket, actual_bracket=None):
+    """
+    Prints a bracket at DEBUG, coloring each team by whether it actually got
+    that far if the actual bracket is given.
+    """
+    log(DEBUG, render_ansi(bracket, actual_bracket))
 
 
 def get_national_championship_game(games):
@@ -307,12 +215,16 @@ def get_national_championship_game(games):
     return championship_games[0]
 
 
-def build_year_mapping_for(data_filename):
+def build_year_mapping_for(data_filename, use_cache=True):
+    if use_cache:
+        try:
+            return ColumnCache.load(data_filename).year_mapping()
+        except OSError as error:
+            log(WARN, "Unable to use the cache for %s, reading it directly: %s", data_filename, error)
+
     year_mapping = {}
     with open(data_filename, 'r') as data_file:
-        reader = csv.reader(data_file, quotechar='"', delimiter=',', quoting=csv.QUOTE_ALL, skipinitialspace=True)
-        headers = next(reader, None)
-        for game in reader:
+        for game in read_rows(data_file):
             year = game[Schema.YEAR]
             if year not in year_mapping:
                 year_mapping[year] = []
@@ -320,66 +232,183 @@ def build_year_mapping_for(data_filename):
     return year_mapping
 
 
-def main(data_file, years, strategies):
-    year_mapping = build_year_mapping_for(data_file)
-
-    aggregated_strategies = dict((strategy.name, {}) for strategy in strategies)
-    for year in years:
-        # Check that our data set has the required number of games at least
-        log(INFO, "%s\n----" % year)
-        tournament_games = year_mapping[str(year)]
-        if len(tournament_games) < 63:
-            raise ValueError("Incomplete year set for year %d (%d entries)" % (year, len(tournament_games)))
-
-        # Construct game objects from the input file
-        games = []
-        season_rankings = {}
-        for entry in tournament_games:
-            if entry[Schema.WINS] != '0' or entry[Schema.LOSSES] != '1':
-                raise ValueError("Encountered unexpected win/loss entry %s" % entry)
-            if entry[Schema.ROUND] == Schema.OPENING_ROUND:
+def load_years(data_filename, years, use_cache=True, use_index=True):
+    """
+    Yields (year, rows) for every requested year, in the requested order,
+    without keeping more than one season of rows from the data file in memory.
+    Without the cache or the year index the file is streamed once instead, so
+    the years come in file order and years it does not have are left out.
+    """
+    if use_cache:
+        try:
+            cache = ColumnCache.load(data_filename)
+        except OSError as error:
+            log(WARN, "Unable to use the cache for %s, reading it directly: %s", data_filename, error)
+        else:
+            for year in years:
+                yield year, cache.rows_for(str(year))
+            return
+
+    for year, tournament_games in read_years(data_filename, [str(year) for year in years], use_index):
+        yield int(year), tournament_games
+
+
+def build_actual_bracket(year, tournament_games):
+    # Check that our data set has the games of a full field at least, sized by its biggest round
+    field_size = max([Schema.ROUND_TEAMS.get(entry[Schema.ROUND].strip(), 2) for entry in tournament_games] + [2])
+    if len(tournament_games) < field_size - 1:
+        raise ValueError("Incomplete year set for year %d (%d entries)" % (year, len(tournament_games)))
+
+    # Construct game objects from the input file
+    games = []
+    season_rankings = {}
+    for entry in tournament_games:
+        if entry[Schema.WINS] != '0' or entry[Schema.LOSSES] != '1':
+            raise ValueError("Encountered unexpected win/loss entry %s" % entry)
+        game = Game(
+            entry[Schema.ROUND].strip(),
+            entry[Schema.TEAM].strip(), entry[Schema.SEED].strip(), entry[Schema.REGION].strip(),
+            entry[Schema.OPPONENT].strip(), entry[Schema.OPPONENT_SEED].strip(), entry[Schema.OPPONENT_REGION].strip(),
+            None, None, None
+        )
+        games.append(game)
+
+        if game.winner_name in season_rankings and season_rankings[game.winner_name] != entry[Schema.OPPONENT_RANKING]:
+            raise ValueError("Ranking mismatch %s has %d and %d" % (game.winner_name, season_rankings[game.winner_name], entry[Schema.OPPONENT_RANKING]))
+        season_rankings[game.winner_name] = entry[Schema.OPPONENT_RANKING]
+        if game.loser_name in season_rankings and season_rankings[game.loser_name] != entry[Schema.RANKING]:
+            raise ValueError("Ranking mismatch %s has %d and %d" % (game.winner_name, season_rankings[game.winner_name], entry[Schema.RANKING]))
+        season_rankings[game.loser_name] = entry[Schema.RANKING]
+
+    return Bracket.from_game(link_games(games), season_rankings, year)
+
+
+def link_games(games, first_round=None):
+    """
+    Builds out the doubly-linked tree in one pass by indexing every game by its
+    round and winner, then returns the national championship game at its root.
+
+    :param games: The unlinked games of a single tournament
+    :param first_round: Games after this round must have both of their previous
+                        games, earlier games (play-ins) may link into it.  The
+                        biggest round of the games if not given.
+    """
+    if first_round is None:
+        first_round = max((game.round for game in games if game.round in Schema.ROUND_TEAMS), key=Schema.ROUND_TEAMS.get,
+                          default=Schema.NATIONAL_CHAMPIONSHIP)
+    rounds = Schema.ROUND_TEAMS[first_round].bit_length() - 1
+    round_orders = dict((round, round_index(round, rounds)) for round in set(game.round for game in games))
+
+    games_by_winner = {}
+    for game in games:
+        key = (round_orders[game.round], game.winner_name)
+        if key in games_by_winner:
+            raise ValueError("Found %s winning more than one game in the %s" % (game.winner_name, game.round))
+        games_by_winner[key] = game
+
+    for game in games:
+        round_order = round_orders[game.round]
+        game.winner_previous_game = games_by_winner.get((round_order - 1, game.winner_name))
+        game.loser_previous_game = games_by_winner.get((round_order - 1, game.loser_name))
+        for previous_game in (game.winner_previous_game, game.loser_previous_game):
+            if not previous_game:
                 continue
-            game = Game(
-                entry[Schema.ROUND].strip(),
-                entry[Schema.TEAM].strip(), entry[Schema.SEED].strip(), entry[Schema.REGION].strip(),
-                entry[Schema.OPPONENT].strip(), entry[Schema.OPPONENT_SEED].strip(), entry[Schema.OPPONENT_REGION].strip(),
-                None, None, None
-            )
-            games.append(game)
-
-            if game.winner_name in season_rankings and season_rankings[game.winner_name] != entry[Schema.OPPONENT_RANKING]:
-                raise ValueError("Ranking mismatch %s has %d and %d" % (game.winner_name, season_rankings[game.winner_name], entry[Schema.OPPONENT_RANKING]))
-            season_rankings[game.winner_name] = entry[Schema.OPPONENT_RANKING]
-            if game.loser_name in season_rankings and season_rankings[game.loser_name] != entry[Schema.RANKING]:
-                raise ValueError("Ranking mismatch %s has %d and %d" % (game.winner_name, season_rankings[game.winner_name], entry[Schema.RANKING]))
-            season_rankings[game.loser_name] = entry[Schema.RANKING]
-
-        # Build out the doubly-linked tree (beginning at the root)
-        for game in games:
-            for other_game in games:
-                if Schema.ROUND_ORDER[other_game.round] == (Schema.ROUND_ORDER[game.round] + 1):
-                    if other_game.winner_name == game.winner_name:
-                        game.next_game = other_game
-                        game.next_game.winner_previous_game = game
-                    if other_game.loser_name == game.winner_name:
-                        game.next_game = other_game
-                        game.next_game.loser_previous_game = game
-
-        log(DEBUG, "------------------- ACTUAL BRACKET ----------------".center(JUSTIFICATION_SIZE * len(Schema.ROUND_ORDER)))
-        bracket_root = get_national_championship_game(games)
-        print_as_bracket(bracket_root)
-
-        for strategy in strategies:
-            log(DEBUG, "------------------- PREDICTED BRACKET ----------------".center(JUSTIFICATION_SIZE * len(Schema.ROUND_ORDER)))
-            predicted_games = deep_copy(bracket_root)
-            wipe_game_recursively(predicted_games)
-            random.seed(strategy.seed)
-            perform_predictions(predicted_games, strategy, season_rankings)
-            print_as_bracket(predicted_games, bracket_root)
-            aggregated_strategies[strategy.name][year] = compute_score(predicted_games, bracket_root, strategy)
-        log(INFO, "")
+            if previous_game.next_game:
+                raise ValueError("Found more than one next game for %s" % previous_game)
+            previous_game.next_game = game
+
+        if round_order > 1 and not (game.winner_previous_game and game.loser_previous_game):
+            raise ValueError("Incomplete bracket, missing previous games for %s" % game)
+
+    bracket_root = get_national_championship_game(games)
+    unlinked_games = [game for game in games if not game.next_game and game is not bracket_root]
+    if unlinked_games:
+        raise ValueError("Found %d games that do not lead to the national championship, e.g. %s" % (len(unlinked_games), unlinked_games[0]))
+    return bracket_root
+
+
+def evaluate_strategy(actual_bracket, strategy, year, samples=0, exact=False):
+    """
+    Predicts a bracket for a strategy and, if asked, computes (exact) or
+    simulates (samples) the distribution of its scores.  Every (year, strategy)
+    pair draws from its own random number generators, so the result does not
+    depend on what ran before it.
+
+    :return: The predicted Bracket and its ExactScore or ScoreDistribution (or
+             None if neither was asked for)
+    """
+    with timed('copy', year, strategy.name):
+        predicted_bracket = actual_bracket.blank()
+    with timed('predict', year, strategy.name):
+        perform_predictions(predicted_bracket, strategy, random.Random(strategy.seed))
+
+    distribution = None
+    if exact:
+        with timed('distribution', year, strategy.name):
+            distribution = analytic.evaluate_strategy(actual_bracket, strategy)
+    elif samples:
+        with timed('distribution', year, strategy.name):
+            distribution = montecarlo.evaluate_strategy(actual_bracket, strategy, samples, numpy.random.default_rng([strategy.seed, year]))
+    return predicted_bracket, distribution
+
+
+_worker_state = None
+
+
+def _initialize_worker(actual_brackets, strategies, samples, exact, log_level, profile):
+    global LOG_LEVEL, _worker_state
+    LOG_LEVEL = log_level
+    _worker_state = (actual_brackets, strategies, samples, exact, profile)
+
+
+def _evaluate_in_worker(task):
+    global TIMER
+    year, strategy_index = task
+    actual_brackets, strategies, samples, exact, profile = _worker_state
+    TIMER = PhaseTimer() if profile else None
+    predicted_bracket, distribution = evaluate_strategy(actual_brackets[year], strategies[strategy_index], year, samples, exact)
+    return predicted_bracket.winners, distribution, TIMER and TIMER.totals
+
+
+def evaluate_all(actual_brackets, strategies, years, samples=0, exact=False, workers=1, tasks=None):
+    """
+    Yields the evaluate_strategy result of every (year, strategy) pair, ordered
+    by year and then strategy.  With more than one worker the pairs are spread
+    over a process pool that receives the parsed brackets once per worker (and
+    sends back its timings when profiling).
+
+    :param tasks: The (year, strategy index) pairs to evaluate, in order, if
+                  not every pair of the years and strategies
+    """
+    if tasks is None:
+        tasks = [(year, strategy_index) for year in years for strategy_index in range(len(strategies))]
+    if not tasks:
+        return
+    if workers <= 1:
+        for year, strategy_index in tasks:
+            yield evaluate_strategy(actual_brackets[year], strategies[strategy_index], year, samples, exact)
+        return
 
+    # Build the matchup tables once here, so the workers receive them with the brackets
+    for actual_bracket in actual_brackets.values():
+        actual_bracket.matchups
+    chunk_size = max(1, len(tasks) // (workers * 4))
+    initargs = (actual_brackets, strategies, samples, exact, LOG_LEVEL, TIMER is not None)
+    with ProcessPoolExecutor(workers, initializer=_initialize_worker, initargs=initargs) as executor:
+        for (year, _), (winners, distribution, timings) in zip(tasks, executor.map(_evaluate_in_worker, tasks, chunksize=chunk_size)):
+            if timings:
+                TIMER.merge(timings)
+            yield actual_brackets[year].with_winners(winners), distribution
+
+
+def print_summary(aggregated_strategies, aggregated_distributions):
+    """
+    Prints every strategy's best, worst, median and mean score over the years
+    (and the same for its expected score, if its distributions were found).
+    """
     for strategy, years in aggregated_strategies.items():
+        if not years:
+            continue
         log(INFO, strategy)
         log(INFO, '-' * len(strategy))
 
@@ -387,18 +416,147 @@ def main(data_file, years, strategies):
         min_with_year = min(years.items(), key=operator.itemgetter(1))
         mean = statistics.mean(years.values())
         median = statistics.median(years.values())
-        log(INFO,
-                "\tMAX: %d (%d)\tMIN: %d (%d)\tMEDIAN: %2.1f\tMEAN: %2.1f\n" %
-                (
-                    max_with_year[1], max_with_year[0],
-                    min_with_year[1], min_with_year[0],
-                    median, mean
-                )
+        summary = "\tMAX: %d (%d)\tMIN: %d (%d)\tMEDIAN: %2.1f\tMEAN: %2.1f\n" % (
+            max_with_year[1], max_with_year[0],
+            min_with_year[1], min_with_year[0],
+            median, mean
         )
+        if aggregated_distributions[strategy]:
+            expected_scores = [distribution.mean for distribution in aggregated_distributions[strategy].values()]
+            summary += "\tEXPECTED MEAN: %2.1f\tEXPECTED MIN: %2.1f\tEXPECTED MAX: %2.1f\n" % (
+                statistics.mean(expected_scores), min(expected_scores), max(expected_scores)
+            )
+        log(INFO, summary)
+
+
+def summarize_stored(store, data_hash, years, strategies, samples=0, exact=False):
+    """Prints the summary of a run from its stored results alone, without simulating anything"""
+    aggregated_strategies = dict((strategy.name, {}) for strategy in strategies)
+    aggregated_distributions = dict((strategy.name, {}) for strategy in strategies)
+    for year in years:
+        stored = store.results(data_hash, year, strategies, samples, exact)
+        for strategy_index, strategy in enumerate(strategies):
+            if strategy_index not in stored:
+                log(WARN, "No stored result for %s in %d", strategy.name, year)
+                continue
+            aggregated_strategies[strategy.name][year] = stored[strategy_index].score
+            if stored[strategy_index].distribution:
+                aggregated_distributions[strategy.name][year] = stored[strategy_index].distribution
+    print_summary(aggregated_strategies, aggregated_distributions)
+
+
+def main(data_file, years, strategies, samples=0, exact=False, workers=1, use_cache=True, profile=False, stats_filename=None,
+         render_filename=None, render_format='ansi', store_filename=None, summary_only=False, use_index=True):
+    global TIMER
+    if profile or stats_filename:
+        TIMER = PhaseTimer()
+
+    # With a store, only the (year, strategy) pairs it does not have yet are evaluated
+    store = None
+    stored = dict((year, {}) for year in years)
+    if store_filename:
+        store = ResultStore(store_filename)
+        data_hash = store.data_hash(data_file)
+        if summary_only:
+            summarize_stored(store, data_hash, years, strategies, samples, exact)
+            store.close()
+            return
+        for year in years:
+            with timed('store', year):
+                stored[year] = store.results(data_hash, year, strategies, samples, exact)
+
+    actual_brackets = {}
+    start = time.perf_counter()
+    # Years are keyed by what load_years yields, as streaming gives them in file order
+    for year, tournament_games in load_years(data_file, years, use_cache, use_index):
+        if TIMER is not None:
+            TIMER.record('load', time.perf_counter() - start, year)
+        with timed('build', year):
+            actual_brackets[year] = build_actual_bracket(year, tournament_games)
+        start = time.perf_counter()
+    missing_years = [year for year in years if year not in actual_brackets]
+    if missing_years:
+        raise ValueError("No games for %s in %s" % (', '.join(str(year) for year in missing_years), data_file))
+    tasks = [(year, strategy_index) for year in years for strategy_index in range(len(strategies)) if strategy_index not in stored[year]]
+    results = evaluate_all(actual_brackets, strategies, years, samples, exact, workers, tasks)
+
+    rendered_brackets = []
+    aggregated_strategies = dict((strategy.name, {}) for strategy in strategies)
+    aggregated_distributions = dict((strategy.name, {}) for strategy in strategies)
+    for year in years:
+        log(INFO, "%s\n----", year)
+        actual_bracket = actual_brackets[year]
+        # Brackets are only ever printed at DEBUG, so skip building them otherwise
+        if LOG_LEVEL <= DEBUG:
+            log(DEBUG, "------------------- ACTUAL BRACKET ----------------".center(JUSTIFICATION_SIZE * (actual_bracket.rounds + 1)))
+            with timed('render', year):
+                print_as_bracket(actual_bracket)
+        if render_filename:
+            rendered_brackets.append(("%d ACTUAL BRACKET" % year, actual_bracket, None))
+
+        for strategy_index, strategy in enumerate(strategies):
+            if strategy_index in stored[year]:
+                predicted_bracket = actual_bracket.with_winners(array('h', stored[year][strategy_index].winners))
+                distribution = stored[year][strategy_index].distribution
+            else:
+                predicted_bracket, distribution = next(results)
+            if LOG_LEVEL <= DEBUG:
+                log(DEBUG, "------------------- PREDICTED BRACKET ----------------".center(JUSTIFICATION_SIZE * (actual_bracket.rounds + 1)))
+                with timed('render', year, strategy.name):
+                    print_as_bracket(predicted_bracket, actual_bracket)
+            if render_filename:
+                rendered_brackets.append(("%d %s" % (year, strategy.name), predicted_bracket, actual_bracket))
+            with timed('score', year, strategy.name):
+                aggregated_strategies[strategy.name][year] = compute_score(predicted_bracket, actual_bracket, strategy)
+            if distribution:
+                aggregated_distributions[strategy.name][year] = distribution
+                log(INFO, "%s %s", EMPTY_SPACE, distribution)
+            if store and strategy_index not in stored[year]:
+                with timed('store', year, strategy.name):
+                    store.save(data_hash, year, strategy, predicted_bracket.winners, aggregated_strategies[strategy.name][year], distribution, samples, exact)
+        if store:
+            with timed('store', year):
+                store.commit()
+        log(INFO, "")
+
+    print_summary(aggregated_strategies, aggregated_distributions)
+    if store:
+        store.close()
+
+    if render_filename:
+        with timed('render'), open(render_filename, 'w', newline='') as render_file:
+            render_all(rendered_brackets, render_file, render_format)
+
+    if profile:
+        for line in TIMER.report():
+            log(INFO, line)
+    if stats_filename:
+        with open(stats_filename, 'w') as stats_file:
+            json.dump({'phases': TIMER.to_json()}, stats_file, indent=2)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", "--file", help="The data file to read in", required=True)
     parser.add_argument("-y", "--years", help="A list of years to perform the simulation on", nargs='+', type=int, required=True)
+    parser.add_argument("-n", "--samples", help="The number of brackets to simulate per strategy and year for the score distribution", type=int, default=0)
+    parser.add_argument("-e", "--exact", help="Compute the exact score distribution per strategy and year instead of sampling it", action="store_true")
+    parser.add_argument("-w", "--workers", help="The number of processes to spread the year and strategy grid over", type=int, default=1)
+    parser.add_argument("--no-cache", help="Always parse the data file instead of using its binary cache", dest="use_cache", action="store_false")
+    parser.add_argument("--no-index", help="With --no-cache, stream the data file once instead of seeking to each year through its index", dest="use_index", action="store_false")
+    parser.add_argument("-s", "--seed-history", help="Add strategies picking by how each seed has fared against the other in past years (leaving out the year predicted)", action="store_true")
+    parser.add_argument("-r", "--render", help="Write every actual and predicted bracket to a file", dest="render_filename")
+    parser.add_argument("--format", help="The format to write brackets in with --render", choices=FORMATS, default='ansi')
+    parser.add_argument("-p", "--profile", help="Print the time spent in each phase per year and strategy", action="store_true")
+    parser.add_argument("--stats", help="Where to save the time spent in each phase as JSON", dest="stats_filename")
+    parser.add_argument("--store", help="An SQLite file to save results in and reuse them from on later runs", dest="store_filename")
+    parser.add_argument("--summary", help="Only print the summary of the results already in --store, without simulating", dest="summary_only", action="store_true")
     args = parser.parse_args()
-    main(args.file, args.years, DefaultStrategies.STRATEGIES)
+    if args.summary_only and not args.store_filename:
+        parser.error("--summary needs --store")
+    if not args.use_index and args.use_cache:
+        parser.error("--no-index needs --no-cache")
+    strategies = DefaultStrategies.STRATEGIES
+    if args.seed_history:
+        strategies = strategies + seed_history_strategies(SeedHistory.load(args.file))
+    main(args.file, args.years, strategies, args.samples, args.exact, args.workers, args.use_cache, args.profile, args.stats_filename,
+         args.render_filename, args.format, args.store_filename, args.summary_only, args.use_index)
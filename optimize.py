@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""
+Searches the space of strategies (favorite bias, protection base and protection
+cutoff round) for the ones that score best over a set of years.  Candidates are
+evaluated exactly with analytic.py, in batches spread over a process pool.
+"""
+
+import argparse
+import random
+import statistics
+
+from concurrent.futures import ProcessPoolExecutor
+
+import analytic
+from ncaa_simulations import INFO, JUSTIFICATION_SIZE, build_actual_bracket, load_years, log
+from schema import Schema
+from strategy import Strategy, DefaultStrategies, ExponentialProtection
+
+BIAS_RANGE = (0.0, 1.0)
+BASE_RANGE = (1.0, 4.0)
+CUTOFFS = [Schema.ORDERED_ROUNDS[round_index] for round_index in range(1, len(Schema.ORDERED_ROUNDS))]
+
+GRID_BIASES = [step / 10.0 for step in range(11)]
+GRID_BASES = [None, 1.5, 2, 2.5, 3, 4]
+
+
+class Candidate:
+    """
+    A point in the strategy space.
+
+    :param favorite_bias: The probability of picking the favorite
+    :param base: The base of the ExponentialProtection (None for no protection)
+    :param cutoff: The last round with any protection
+    """
+    def __init__(self, favorite_bias, base=None, cutoff=Schema.SWEET_SIXTEEN):
+        self.favorite_bias = round(min(max(favorite_bias, BIAS_RANGE[0]), BIAS_RANGE[1]), 3)
+        self.base = None if base is None else round(min(max(base, BASE_RANGE[0]), BASE_RANGE[1]), 2)
+        self.cutoff = Schema.SWEET_SIXTEEN if base is None else cutoff
+
+    @property
+    def key(self):
+        return (self.favorite_bias, self.base, self.cutoff)
+
+    @property
+    def name(self):
+        if self.base is None:
+            return "%d%% favorites" % round(self.favorite_bias * 100)
+        return "%d%% w/POW(%g) through %s" % (round(self.favorite_bias * 100), self.base, self.cutoff)
+
+    def to_strategy(self, seed=DefaultStrategies.SEED):
+        protected_function = None
+        if self.base is not None:
+            protected_function = ExponentialProtection(self.base, self.cutoff)
+        return Strategy(self.name, seed, self.favorite_bias, protected_function)
+
+    def neighbors(self, step, rng):
+        """Random nearby candidates, for adaptive search"""
+        cutoff_index = CUTOFFS.index(self.cutoff)
+        neighbors = []
+        for _ in range(4):
+            base = self.base
+            if base is not None or rng.random() < step:
+                base = (base or 2.0) + rng.uniform(-1, 1) * step * (BASE_RANGE[1] - BASE_RANGE[0])
+            cutoff = CUTOFFS[min(max(cutoff_index + rng.choice((-1, 0, 1)), 0), len(CUTOFFS) - 1)]
+            neighbors.append(Candidate(self.favorite_bias + rng.uniform(-1, 1) * step, base, cutoff))
+        return neighbors
+
+
+def grid_candidates():
+    candidates = []
+    for favorite_bias in GRID_BIASES:
+        for base in GRID_BASES:
+            for cutoff in (CUTOFFS if base is not None else [Schema.SWEET_SIXTEEN]):
+                candidates.append(Candidate(favorite_bias, base, cutoff))
+    return candidates
+
+
+def random_candidates(count, rng):
+    return [
+        Candidate(
+            rng.uniform(*BIAS_RANGE),
+            rng.uniform(*BASE_RANGE) if rng.random() > 0.1 else None,
+            rng.choice(CUTOFFS)
+        )
+        for _ in range(count)
+    ]
+
+
+def objective_value(score, objective):
+    """Reduces an ExactScore to the objective, 'mean' or a percentile like 'p10'"""
+    if objective == 'mean':
+        return score.mean
+    return score.percentile(float(objective[1:]))
+
+
+_worker_state = None
+
+
+def _initialize_worker(actual_brackets, objective):
+    global _worker_state
+    _worker_state = (actual_brackets, objective)
+
+
+def _evaluate_in_worker(candidate):
+    actual_brackets, objective = _worker_state
+    return evaluate_candidate(candidate, actual_brackets, objective)
+
+
+def evaluate_candidate(candidate, actual_brackets, objective):
+    """The objective of a candidate for every year, in year order"""
+    strategy = candidate.to_strategy()
+    return [
+        objective_value(analytic.evaluate_strategy(actual_brackets[year], strategy), objective)
+        for year in sorted(actual_brackets)
+    ]
+
+
+class Evaluator:
+    """
+    Evaluates batches of candidates, remembering every result so no candidate
+    is evaluated twice over the course of a search.
+
+    :param actual_brackets: Mapping of year to its actual Bracket
+    :param objective: 'mean' or a percentile like 'p10'
+    :param workers: The number of processes to spread a batch over
+    """
+    def __init__(self, actual_brackets, objective, workers=1):
+        self.actual_brackets = actual_brackets
+        self.objective = objective
+        self.workers = workers
+        self.cache = {}
+        self.candidates = {}
+        self.executor = None
+        if workers > 1:
+            for actual_bracket in actual_brackets.values():
+                actual_bracket.matchups
+            self.executor = ProcessPoolExecutor(workers, initializer=_initialize_worker, initargs=(actual_brackets, objective))
+
+    def evaluate(self, candidates):
+        """Evaluates the candidates not seen before, returning how many there were"""
+        pending = []
+        for candidate in candidates:
+            if candidate.key not in self.candidates:
+                self.candidates[candidate.key] = candidate
+                pending.append(candidate)
+
+        if self.executor:
+            chunk_size = max(1, len(pending) // (self.workers * 4))
+            results = self.executor.map(_evaluate_in_worker, pending, chunksize=chunk_size)
+        else:
+            results = (evaluate_candidate(candidate, self.actual_brackets, self.objective) for candidate in pending)
+        for candidate, per_year in zip(pending, results):
+            self.cache[candidate.key] = per_year
+        return len(pending)
+
+    def leaderboard(self):
+        """Every evaluated candidate as (average objective, per-year objectives, candidate), best first"""
+        return sorted(
+            ((statistics.mean(per_year), per_year, self.candidates[key]) for (key, per_year) in self.cache.items()),
+            key=lambda entry: -entry[0]
+        )
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+
+
+def optimize(data_file, years, search='adaptive', objective='mean', budget=300, workers=1, seed=DefaultStrategies.SEED, use_cache=True):
+    """
+    Searches the strategy space over a set of years.
+
+    :param search: 'grid', 'random' or 'adaptive' (random, then refined around the best)
+    :param objective: 'mean' or a percentile like 'p10' of each year's score,
+                      averaged over the years
+    :param budget: The number of candidates for random and adaptive search
+    :return: The leaderboard, see Evaluator.leaderboard
+    """
+    actual_brackets = dict(
+        (year, build_actual_bracket(year, tournament_games))
+        for (year, tournament_games) in load_years(data_file, years, use_cache)
+    )
+    rng = random.Random(seed)
+    evaluator = Evaluator(actual_brackets, objective, workers)
+    try:
+        if search == 'grid':
+            evaluator.evaluate(grid_candidates())
+        elif search == 'random':
+            evaluator.evaluate(random_candidates(budget, rng))
+        elif search == 'adaptive':
+            evaluator.evaluate(random_candidates(budget // 3, rng))
+            step = 0.25
+            while len(evaluator.cache) < budget:
+                elite = [candidate for (_, _, candidate) in evaluator.leaderboard()[:8]]
+                evaluated = evaluator.evaluate(neighbor for candidate in elite for neighbor in candidate.neighbors(step, rng))
+                if not evaluated and step == 0.01:
+                    break
+                step = max(step * 0.7, 0.01)
+        else:
+            raise ValueError("Unknown search %s" % search)
+    finally:
+        evaluator.close()
+    return evaluator.leaderboard()
+
+
+def print_leaderboard(leaderboard, years, top):
+    log(INFO, "%s %s  %s", 'STRATEGY'.ljust(JUSTIFICATION_SIZE + 17), 'SCORE'.rjust(6), ' '.join(str(year) for year in sorted(years)))
+    for rank, (value, per_year, candidate) in enumerate(leaderboard[:top], 1):
+        log(INFO, "%3d. %s %6.1f  %s",
+            rank,
+            candidate.name.ljust(JUSTIFICATION_SIZE + 12),
+            value,
+            ' '.join(('%4.0f' % year_value).rjust(len(str(year))) for (year, year_value) in zip(sorted(years), per_year)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--file", help="The data file to read in", required=True)
+    parser.add_argument("-y", "--years", help="A list of years to evaluate strategies on", nargs='+', type=int, required=True)
+    parser.add_argument("-s", "--search", help="How to search the strategy space", choices=['grid', 'random', 'adaptive'], default='adaptive')
+    parser.add_argument("-o", "--objective", help="What to maximize: 'mean' or a percentile such as 'p10'", default='mean')
+    parser.add_argument("-b", "--budget", help="The number of strategies to evaluate in random and adaptive search", type=int, default=300)
+    parser.add_argument("-t", "--top", help="The number of strategies to show", type=int, default=20)
+    parser.add_argument("-w", "--workers", help="The number of processes to evaluate strategies with", type=int, default=1)
+    parser.add_argument("--no-cache", help="Always parse the data file instead of using its binary cache", dest="use_cache", action="store_false")
+    args = parser.parse_args()
+    if args.objective != 'mean' and not (args.objective.startswith('p') and args.objective[1:].replace('.', '', 1).isdigit()):
+        parser.error("objective must be 'mean' or a percentile such as 'p10'")
+    leaderboard = optimize(args.file, args.years, args.search, args.objective, args.budget, args.workers, use_cache=args.use_cache)
+    print_leaderboard(leaderboard, args.years, args.top)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+"""
+Scores a pool of submitted brackets (e.g. an office pool) against the actual,
+possibly still unfinished, tournament.  Entries are read in a compact form, a
+pick mask or an array of team ids, and are scored together as one array rather
+than one bracket at a time.  The chance of each entry winning the pool is
+estimated by simulating the games that are left.
+"""
+
+import argparse
+import csv
+
+import numpy
+
+import montecarlo
+from bracket import EMPTY
+from datafile import read_rows
+from live import LiveTournament, apply_lines, describe_pending, read_field
+from ncaa_simulations import INFO, JUSTIFICATION_SIZE, build_actual_bracket, load_years, log
+from matchups import FavoriteBias
+from strategy import DefaultStrategies
+
+# Roughly how often the better seed has won a tournament game
+DEFAULT_FAVORITE_BIAS = 0.7
+DEFAULT_SIMULATIONS = 1000
+SIMULATION_CELLS = 20000000
+
+
+def slot_teams(picks, bracket, round_index):
+    """
+    The (left, right) teams meeting in every slot of a round, for an array of
+    picks with one row per entry and one column per slot.
+    """
+    round_slice = bracket.round_slice(round_index)
+    if round_index == 1:
+        left = numpy.broadcast_to(numpy.arange(0, bracket.teams, 2, dtype=numpy.int16), (picks.shape[0], bracket.teams // 2))
+        return left, left + 1
+    previous_winners = picks[:, 2 * round_slice.start + 1:2 * round_slice.stop + 1]
+    return previous_winners[:, 0::2], previous_winners[:, 1::2]
+
+
+def decode_masks(masks, bracket):
+    """
+    Expands pick masks into team ids.  Bit i of a mask is set when the left
+    (upper) team wins slot i of the bracket, see bracket.Bracket.  Masks are
+    as wide as the bracket has games, so bigger fields need more than 64 bits.
+
+    :param masks: One integer mask per entry
+    :return: An array of winning team ids with one row per entry and one
+             column per slot
+    """
+    mask_bytes = (bracket.games + 7) // 8
+    try:
+        packed = b''.join(int(mask).to_bytes(mask_bytes, 'little') for mask in masks)
+    except OverflowError:
+        raise ValueError("Found a mask that is negative or has more than %d bits" % bracket.games)
+    bits = numpy.unpackbits(numpy.frombuffer(packed, dtype=numpy.uint8).reshape(len(masks), mask_bytes), axis=1, bitorder='little')
+    if bits[:, bracket.games:].any():
+        raise ValueError("Found a mask with more than %d bits" % bracket.games)
+    left_wins = bits[:, :bracket.games].astype(bool)
+
+    picks = numpy.empty((len(masks), bracket.games), dtype=numpy.int16)
+    for round_index in range(1, bracket.rounds + 1):
+        left, right = slot_teams(picks, bracket, round_index)
+        round_slice = bracket.round_slice(round_index)
+        picks[:, round_slice] = numpy.where(left_wins[:, round_slice], left, right)
+    return picks
+
+
+def encode_masks(picks, bracket):
+    """The pick masks of an array of team ids as integers, see decode_masks"""
+    validate_picks(picks, bracket)
+    left_wins = numpy.empty(picks.shape, dtype=bool)
+    for round_index in range(1, bracket.rounds + 1):
+        left, _ = slot_teams(picks, bracket, round_index)
+        round_slice = bracket.round_slice(round_index)
+        left_wins[:, round_slice] = picks[:, round_slice] == left
+    packed = numpy.packbits(left_wins, axis=1, bitorder='little')
+    return [int.from_bytes(row.tobytes(), 'little') for row in packed]
+
+
+def validate_picks(picks, bracket):
+    """Checks that every pick is one of the two teams its entry has meeting in that slot"""
+    if picks.ndim != 2 or picks.shape[1] != bracket.games:
+        raise ValueError("Expecting %d picks per entry, but found an array of shape %s" % (bracket.games, picks.shape))
+    for round_index in range(1, bracket.rounds + 1):
+        left, right = slot_teams(picks, bracket, round_index)
+        round_picks = picks[:, bracket.round_slice(round_index)]
+        invalid = numpy.flatnonzero(~numpy.all((round_picks == left) | (round_picks == right), axis=1))
+        if len(invalid):
+            raise ValueError("Found %d entries picking a team that is not playing in the %s, e.g. entry %d" % (
+                len(invalid), bracket.round_name(round_index), invalid[0]
+            ))
+
+
+def read_entries(entries_filename, bracket):
+    """
+    Reads a pool from a CSV with a header and one (name, picks) row per entry.
+    The picks are either a pick mask (see decode_masks, in decimal or 0x hex)
+    or the team id picked in every slot separated by spaces, where team ids
+    are positions in first round order.
+
+    :return: The entry names and an array of their picks
+    """
+    names = []
+    masks = []
+    mask_rows = []
+    team_ids = []
+    team_id_rows = []
+    with open(entries_filename, 'r') as entries_file:
+        for row_index, row in enumerate(read_rows(entries_file)):
+            if len(row) < 2:
+                raise ValueError("Expecting an entry name and picks, but found %s" % row)
+            names.append(row[0].strip())
+            picks = row[1].split()
+            if len(picks) == 1:
+                masks.append(int(picks[0], 0))
+                mask_rows.append(row_index)
+            else:
+                team_ids.append([int(team) for team in picks])
+                team_id_rows.append(row_index)
+
+    picks = numpy.empty((len(names), bracket.games), dtype=numpy.int16)
+    if masks:
+        picks[mask_rows] = decode_masks(masks, bracket)
+    if team_ids:
+        if any(len(entry) != bracket.games for entry in team_ids):
+            raise ValueError("Expecting %d team ids per entry" % bracket.games)
+        picks[team_id_rows] = numpy.array(team_ids, dtype=numpy.int16)
+        validate_picks(picks, bracket)
+    return names, picks
+
+
+def write_entries(names, picks, bracket, entries_filename):
+    """Writes a pool as pick masks, see read_entries"""
+    with open(entries_filename, 'w', newline='') as entries_file:
+        writer = csv.writer(entries_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(['Entry', 'Picks'])
+        for name, mask in zip(names, encode_masks(picks, bracket)):
+            writer.writerow([name, '0x%x' % mask])
+
+
+def score_entries(picks, actual_bracket):
+    """
+    Scores every entry against a (possibly unfinished) actual bracket.
+
+    :return: The current score of every entry, and the most it can still reach
+             with its picks that have not been knocked out
+    """
+    weights = montecarlo.round_weights(actual_bracket)
+    current = montecarlo.score_predictions(picks, actual_bracket, weights)
+
+    eliminated = numpy.zeros(actual_bracket.teams, dtype=bool)
+    for slot in range(actual_bracket.games):
+        winner = actual_bracket.winners[slot]
+        if winner != EMPTY:
+            left, right = actual_bracket.slot_teams(slot)
+            eliminated[right if winner == left else left] = True
+    undecided = numpy.asarray(actual_bracket.winners, dtype=numpy.int16) == EMPTY
+    maximum = current + (undecided & ~eliminated[picks]).astype(numpy.int32) @ weights
+    return current, maximum
+
+
+def win_probabilities(picks, actual_bracket, model, simulations, rng):
+    """
+    Estimates each entry's chance of winning the pool by simulating the games
+    left to play with a probability model (see matchups.py), sharing the win
+    between the entries tied for the best score of a simulation.
+    """
+    weights = montecarlo.round_weights(actual_bracket)
+    current = montecarlo.score_predictions(picks, actual_bracket, weights)
+    undecided = [slot for slot in range(actual_bracket.games) if actual_bracket.winners[slot] == EMPTY]
+    picks_by_slot = numpy.ascontiguousarray(picks.T)
+
+    wins = numpy.zeros(picks.shape[0])
+    batch_size = max(1, SIMULATION_CELLS // max(1, picks.shape[0]))
+    for start in range(0, simulations, batch_size):
+        count = min(batch_size, simulations - start)
+        outcomes = montecarlo.simulate_results(actual_bracket, model, rng.random((count, actual_bracket.games)), actual_bracket)
+        scores = numpy.repeat(current[numpy.newaxis, :], count, axis=0)
+        for slot in undecided:
+            scores += weights[slot] * (outcomes[:, slot, numpy.newaxis] == picks_by_slot[slot])
+        leaders = scores == scores.max(axis=1, keepdims=True)
+        wins += (leaders / leaders.sum(axis=1, keepdims=True)).sum(axis=0)
+    return wins / simulations
+
+
+def standings(names, current, maximum, probabilities=None):
+    """The entries as (rank, name, score, maximum, win probability), best first"""
+    order = numpy.lexsort((-maximum, -current))
+    ranked = []
+    rank = 0
+    for position, entry in enumerate(order):
+        if position == 0 or current[entry] != current[order[position - 1]]:
+            rank = position + 1
+        ranked.append((rank, names[entry], int(current[entry]), int(maximum[entry]), None if probabilities is None else float(probabilities[entry])))
+    return ranked
+
+
+def main(names, picks, actual_bracket, simulations, favorite_bias, top, output_filename=None):
+    current, maximum = score_entries(picks, actual_bracket)
+    probabilities = None
+    if simulations:
+        probabilities = win_probabilities(picks, actual_bracket, FavoriteBias(favorite_bias), simulations, numpy.random.default_rng(DefaultStrategies.SEED))
+    ranked = standings(names, current, maximum, probabilities)
+
+    log(INFO, "%s %s %s %s %s", 'RANK'.rjust(5), 'ENTRY'.ljust(JUSTIFICATION_SIZE), 'SCORE'.rjust(5), 'MAX'.rjust(5), 'WIN %'.rjust(7))
+    for rank, name, score, entry_maximum, probability in ranked[:top]:
+        line = "%5d %s %5d %5d" % (rank, name[:JUSTIFICATION_SIZE].ljust(JUSTIFICATION_SIZE), score, entry_maximum)
+        if probability is not None:
+            line += " %7.2f" % (100 * probability)
+        log(INFO, line)
+
+    if output_filename:
+        with open(output_filename, 'w', newline='') as output_file:
+            writer = csv.writer(output_file, quoting=csv.QUOTE_ALL)
+            writer.writerow(['Rank', 'Entry', 'Score', 'Max', 'Win Probability'])
+            writer.writerows(ranked)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--entries", help="The pool entries (name, picks as a mask or team ids) as a CSV", required=True)
+    parser.add_argument("--field", help="A field file listing the teams in first round order, see live.py")
+    parser.add_argument("-f", "--file", help="A data file to take the field and results from, along with --year")
+    parser.add_argument("-y", "--year", help="The year of the data file to take the field and results from", type=int)
+    parser.add_argument("-r", "--results", help="Results so far in the Game By Game schema (all of the year's if not given)")
+    parser.add_argument("-s", "--simulations", help="The number of simulations of the remaining games for win probabilities", type=int, default=DEFAULT_SIMULATIONS)
+    parser.add_argument("-b", "--favorite-bias", help="The chance of the favorite winning a simulated game", type=float, default=DEFAULT_FAVORITE_BIAS)
+    parser.add_argument("-t", "--top", help="The number of entries to show", type=int, default=20)
+    parser.add_argument("-o", "--output", help="Where to write the full standings as a CSV")
+    args = parser.parse_args()
+
+    actual_bracket = None
+    if args.field:
+        field = read_field(args.field)
+    elif args.file and args.year:
+        (year, tournament_games), = load_years(args.file, [args.year])
+        actual_bracket = build_actual_bracket(year, tournament_games)
+        field = actual_bracket.blank()
+    else:
+        parser.error("either --field or --file and --year are required")
+
+    if args.results:
+        tournament = LiveTournament(field, numpy.empty((0, field.games), dtype=numpy.int16))
+        with open(args.results, 'r') as results_file:
+            apply_lines(tournament, results_file, strict=True)
+        if tournament.pending:
+            raise ValueError("Missing the games before %s in %s" % (describe_pending(tournament), args.results))
+        actual_bracket = tournament.actual
+    elif actual_bracket is None:
+        parser.error("--results is required with --field")
+
+    names, picks = read_entries(args.entries, field)
+    main(names, picks, actual_bracket, args.simulations, args.favorite_bias, args.top, args.output)
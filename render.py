@@ -0,0 +1,236 @@
+"""
+Renders brackets as text for the terminal (ANSI colors), HTML, JSON or CSV.
+Every format works straight from a Bracket and builds its whole output in one
+buffer, so many brackets can be written to a file in one batch.
+"""
+
+import csv
+import html
+import io
+import json
+
+from bracket import EMPTY
+
+COLOR_FORMAT = "\033[%dm"
+COLOR_ENDING = "\033[0m"
+JUSTIFICATION_SIZE = 33
+EMPTY_SPACE = ''.ljust(JUSTIFICATION_SIZE)
+TEAM_HEADER = '|_ '
+LOSS_COLOR = 31
+WIN_COLOR = 32
+NEUTRAL_COLOR = 0
+
+FORMATS = ['ansi', 'html', 'json', 'csv']
+
+HTML_CLASSES = {
+    NEUTRAL_COLOR   : 'neutral',
+    WIN_COLOR       : 'win',
+    LOSS_COLOR      : 'loss'
+}
+HTML_HEADER = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+table.bracket { border-collapse: collapse; font-family: monospace; margin-bottom: 2em; }
+table.bracket td { padding: 0 1em 0 0; white-space: nowrap; }
+table.bracket td.team { border-bottom: 1px solid #888; }
+table.bracket .win { color: #080; }
+table.bracket .loss { color: #c00; }
+</style>
+</head>
+<body>
+"""
+HTML_FOOTER = "</body>\n</html>\n"
+CSV_HEADER = ['Bracket', 'Round', 'Slot', 'Winner', 'Winner Seed', 'Loser', 'Loser Seed', 'Correct']
+
+_decorated_strings = {}
+
+
+def create_decorated_string(team, ranking, color):
+    key = (team, ranking, color)
+    if key not in _decorated_strings:
+        decorated_string = "%s [%s] " % (team, ranking)
+        padding = '_' * (JUSTIFICATION_SIZE - len(decorated_string) - len(TEAM_HEADER))
+        _decorated_strings[key] = TEAM_HEADER + COLOR_FORMAT % color + decorated_string + COLOR_ENDING + padding
+    return _decorated_strings[key]
+
+
+def determine_print_color(team_name, previous_round_winners):
+    if not previous_round_winners:
+        return NEUTRAL_COLOR
+    if team_name in previous_round_winners:
+        return WIN_COLOR
+    return LOSS_COLOR
+
+
+def team_color(bracket, actual_bracket, team, round_index):
+    """
+    The color of a team shown in a round: whether it actually got that far,
+    which is only known after the first round and with an actual bracket.
+    """
+    if actual_bracket is None or round_index <= 1:
+        return NEUTRAL_COLOR
+    return determine_print_color(bracket.names[team], actual_bracket.round_winner_names(round_index - 1))
+
+
+def grid_cells(bracket, actual_bracket=None):
+    """
+    Yields (row, column, team, color) for every team shown in the diamond
+    layout: the champion in the first column, then each round from the
+    national championship out to the first round.  Within a column the games
+    run winner side first, as they have always been printed.
+    """
+    rounds = bracket.rounds
+    champion = bracket.winners[0]
+    champion_color = NEUTRAL_COLOR
+    if actual_bracket is not None:
+        champion_color = determine_print_color(bracket.names[champion], actual_bracket.round_winner_names(rounds))
+    yield (1 << rounds) - 1, 0, champion, champion_color
+
+    slots = [0]
+    for column, round_index in enumerate(range(rounds, 0, -1), 1):
+        spacing = 1 << round_index
+        row = (1 << (round_index - 1)) - 1
+        next_slots = []
+        for slot in slots:
+            left, right = bracket.slot_teams(slot)
+            winner = bracket.winners[slot]
+            loser = right if winner == left else left
+            yield row, column, winner, team_color(bracket, actual_bracket, winner, round_index)
+            yield row + spacing, column, loser, team_color(bracket, actual_bracket, loser, round_index)
+            row += 2 * spacing
+            if slot < bracket.first_round_start:
+                winner_slot, loser_slot = (2 * slot + 1, 2 * slot + 2) if winner == left else (2 * slot + 2, 2 * slot + 1)
+                next_slots.extend((winner_slot, loser_slot))
+        slots = next_slots
+
+
+def render_ansi(bracket, actual_bracket=None):
+    """The bracket laid out as a diamond of ANSI colored text, one line per row"""
+    rows = [[EMPTY_SPACE] * (bracket.rounds + 1) for _ in range((2 << bracket.rounds) - 1)]
+    for row, column, team, color in grid_cells(bracket, actual_bracket):
+        if row < len(rows):
+            rows[row][column] = create_decorated_string(bracket.names[team], bracket.seeds[team], color)
+    return '\n'.join(''.join(row) for row in rows)
+
+
+def render_html(bracket, actual_bracket=None, title=None):
+    """The same layout as render_ansi as an HTML table (without the surrounding page)"""
+    rows = [[None] * (bracket.rounds + 1) for _ in range((2 << bracket.rounds) - 1)]
+    for row, column, team, color in grid_cells(bracket, actual_bracket):
+        if row < len(rows):
+            rows[row][column] = '<td class="team %s">%s [%d]</td>' % (HTML_CLASSES[color], html.escape(bracket.names[team]), bracket.seeds[team])
+
+    output = []
+    if title:
+        output.append('<h2>%s</h2>' % html.escape(title))
+    output.append('<table class="bracket">')
+    for row in rows:
+        output.append('<tr>%s</tr>' % ''.join(cell or '<td></td>' for cell in row))
+    output.append('</table>')
+    return '\n'.join(output)
+
+
+def bracket_games(bracket, actual_bracket=None):
+    """
+    Every decided game of a bracket as dictionaries, by round from the play-in
+    games (which are not picked, so have no slot and are not marked correct).
+    """
+    games = []
+    for team, (name, seed, region, _) in sorted(bracket.play_ins.items()):
+        games.append({
+            'round': bracket.round_name(0),
+            'slot': None,
+            'winner': {'name': bracket.names[team], 'seed': bracket.seeds[team], 'region': bracket.regions[team]},
+            'loser': {'name': name, 'seed': seed, 'region': region},
+            'correct': None
+        })
+    for round_index in range(1, bracket.rounds + 1):
+        round_slice = bracket.round_slice(round_index)
+        for slot in range(round_slice.start, round_slice.stop):
+            winner = bracket.winners[slot]
+            if winner == EMPTY:
+                continue
+            left, right = bracket.slot_teams(slot)
+            loser = right if winner == left else left
+            correct = None
+            if actual_bracket is not None and actual_bracket.winners[slot] != EMPTY:
+                correct = actual_bracket.winners[slot] == winner
+            games.append({
+                'round': bracket.round_name(round_index),
+                'slot': slot,
+                'winner': {'name': bracket.names[winner], 'seed': bracket.seeds[winner], 'region': bracket.regions[winner]},
+                'loser': {'name': bracket.names[loser], 'seed': bracket.seeds[loser], 'region': bracket.regions[loser]},
+                'correct': correct
+            })
+    return games
+
+
+def bracket_document(bracket, actual_bracket=None, title=None):
+    """The bracket as a JSON-friendly dictionary"""
+    champion = bracket.winners[0]
+    return {
+        'title': title,
+        'champion': None if champion == EMPTY else bracket.names[champion],
+        'games': bracket_games(bracket, actual_bracket)
+    }
+
+
+def render_json(bracket, actual_bracket=None, title=None):
+    return json.dumps(bracket_document(bracket, actual_bracket, title), indent=2)
+
+
+def csv_rows(bracket, actual_bracket=None, title=None):
+    return [
+        [title or '', game['round'], game['slot'], game['winner']['name'], game['winner']['seed'],
+         game['loser']['name'], game['loser']['seed'], '' if game['correct'] is None else int(game['correct'])]
+        for game in bracket_games(bracket, actual_bracket)
+    ]
+
+
+def render_csv(bracket, actual_bracket=None, title=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+    writer.writerow(CSV_HEADER)
+    writer.writerows(csv_rows(bracket, actual_bracket, title))
+    return buffer.getvalue()
+
+
+def render(bracket, actual_bracket=None, format='ansi', title=None):
+    """Renders a single bracket in any of the FORMATS"""
+    if format == 'ansi':
+        text = render_ansi(bracket, actual_bracket)
+        return text if title is None else title + '\n' + text
+    if format == 'html':
+        return HTML_HEADER + render_html(bracket, actual_bracket, title) + '\n' + HTML_FOOTER
+    if format == 'json':
+        return render_json(bracket, actual_bracket, title)
+    if format == 'csv':
+        return render_csv(bracket, actual_bracket, title)
+    raise ValueError("Unknown format %s, expecting one of %s" % (format, ', '.join(FORMATS)))
+
+
+def render_all(brackets, output_file, format='ansi'):
+    """
+    Writes many brackets to an open file in one format, one write per bracket.
+
+    :param brackets: (title, bracket, actual bracket or None) for every bracket
+    """
+    if format == 'ansi':
+        for title, bracket, actual_bracket in brackets:
+            output_file.write(title + '\n' + render_ansi(bracket, actual_bracket) + '\n\n')
+    elif format == 'html':
+        output_file.write(HTML_HEADER)
+        for title, bracket, actual_bracket in brackets:
+            output_file.write(render_html(bracket, actual_bracket, title) + '\n')
+        output_file.write(HTML_FOOTER)
+    elif format == 'json':
+        json.dump([bracket_document(bracket, actual_bracket, title) for (title, bracket, actual_bracket) in brackets], output_file, indent=2)
+    elif format == 'csv':
+        writer = csv.writer(output_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(CSV_HEADER)
+        for title, bracket, actual_bracket in brackets:
+            writer.writerows(csv_rows(bracket, actual_bracket, title))
+    else:
+        raise ValueError("Unknown format %s, expecting one of %s" % (format, ', '.join(FORMATS)))
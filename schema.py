@@ -57,6 +57,8 @@ class Schema:
     }
 
     OPENING_ROUND = "Opening Round"
+    ROUND_OF_256 = "Round of 256"
+    ROUND_OF_128 = "Round of 128"
     ROUND_OF_64 = "Round of 64"
     ROUND_OF_32 = "Round of 32"
     SWEET_SIXTEEN = "Sweet Sixteen"
@@ -64,6 +66,7 @@ class Schema:
     NATIONAL_SEMIFINALS = "National Semifinals"
     NATIONAL_CHAMPIONSHIP = "National Championship"
 
+    # The rounds of a 64 team field, in order
     ROUND_ORDER = {
         OPENING_ROUND           : 0,
         ROUND_OF_64             : 1,
@@ -75,3 +78,19 @@ class Schema:
     }
 
     ORDERED_ROUNDS = dict((value, key) for (key, value) in ROUND_ORDER.items())
+
+    # The number of teams still in at the start of each round, for a field of any
+    # size (its first round being the largest).  Play-in games all belong to the
+    # opening round, before whichever round is first.
+    ROUND_TEAMS = {
+        ROUND_OF_256            : 256,
+        ROUND_OF_128            : 128,
+        ROUND_OF_64             : 64,
+        ROUND_OF_32             : 32,
+        SWEET_SIXTEEN           : 16,
+        ELITE_EIGHT             : 8,
+        NATIONAL_SEMIFINALS     : 4,
+        NATIONAL_CHAMPIONSHIP   : 2
+    }
+
+    ROUNDS_BY_TEAMS = dict((value, key) for (key, value) in ROUND_TEAMS.items())
@@ -0,0 +1,139 @@
+"""
+Empirical seed versus seed win rates per round, from every game in a data file.
+The counts are kept per year so that any one year can be left out of them (as
+a backtest of that year must) by subtracting its counts from the totals.
+"""
+
+import numpy
+
+from datafile import describe_source, load_json, matches_source, read_rows, save_json
+from schema import Schema
+from strategy import Strategy, DefaultStrategies, ExponentialProtection
+
+HISTORY_SUFFIX = '.seeds'
+
+# How many games' worth of weight the rate over all rounds gets in each round's rate
+PRIOR_GAMES = 2.0
+
+
+class SeedHistory:
+    """
+    How many games each seed won against each other seed in every round, per
+    year.
+
+    :param counts: Mapping of year (as a string) to a list of
+                   [round order, winner seed, loser seed, games]
+    """
+    def __init__(self, counts):
+        self.counts = counts
+        self.years = dict((year, index) for (index, year) in enumerate(sorted(counts)))
+        max_seed = max([max(winner_seed, loser_seed) for rows in counts.values() for (_, winner_seed, loser_seed, _) in rows] + [16])
+
+        # wins[year, round, seed, opponent seed] is how often the seed won
+        self.wins = numpy.zeros((len(self.years), len(Schema.ROUND_ORDER), max_seed + 1, max_seed + 1), dtype=numpy.int32)
+        for year, rows in counts.items():
+            for round_order, winner_seed, loser_seed, games in rows:
+                self.wins[self.years[year], round_order, winner_seed, loser_seed] += games
+        self.total_wins = self.wins.sum(axis=0)
+        self._win_rates = {}
+
+    @property
+    def max_seed(self):
+        return self.wins.shape[2] - 1
+
+    def wins_without(self, excluded_year=None):
+        """The total wins over every year but one, found by subtracting its counts"""
+        if excluded_year is None or str(excluded_year) not in self.years:
+            return self.total_wins
+        return self.total_wins - self.wins[self.years[str(excluded_year)]]
+
+    def win_rates(self, excluded_year=None):
+        """
+        rates[round, seed, opponent seed] is how often the seed has beaten the
+        opponent seed in a round, leaving out one year if given.  Each round's
+        rate is pulled towards the rate over all rounds, which itself starts
+        from an even chance, so rare or unseen matchups still get a rate.
+        """
+        key = None if excluded_year is None else str(excluded_year)
+        if key not in self._win_rates:
+            wins = self.wins_without(excluded_year).astype(numpy.float64)
+            games = wins + wins.transpose(0, 2, 1)
+            all_round_wins = wins.sum(axis=0)
+            all_round_rates = (all_round_wins + 1.0) / (all_round_wins + all_round_wins.T + 2.0)
+            self._win_rates[key] = (wins + PRIOR_GAMES * all_round_rates) / (games + PRIOR_GAMES)
+        return self._win_rates[key]
+
+    @staticmethod
+    def load(data_filename):
+        """
+        Reads the seed history of a data file, (re)building it first if it is
+        missing or out of date.  If it cannot be saved it is only kept in memory.
+        """
+        history_filename = data_filename + HISTORY_SUFFIX
+        contents = load_json(history_filename, 'years')
+        if contents is not None:
+            mtime_ns = contents['source']['mtime_ns']
+            if matches_source(data_filename, contents['source']):
+                if contents['source']['mtime_ns'] != mtime_ns:
+                    save_json(history_filename, contents)
+                return SeedHistory(contents['years'])
+
+        source = describe_source(data_filename)
+        history = SeedHistory.build(data_filename)
+        save_json(history_filename, {'source': source, 'years': history.counts})
+        return history
+
+    @staticmethod
+    def build(data_filename):
+        """Counts the seed matchups of every game in one pass over the data file"""
+        counts = {}
+        with open(data_filename, 'r') as data_file:
+            for row in read_rows(data_file):
+                # Only the rounds of a 64 team field (and its play-ins) are counted
+                if row[Schema.ROUND].strip() not in Schema.ROUND_ORDER:
+                    continue
+                # Every row is a loss, the opponent won
+                key = (Schema.ROUND_ORDER[row[Schema.ROUND].strip()], int(row[Schema.OPPONENT_SEED]), int(row[Schema.SEED]))
+                year_counts = counts.setdefault(row[Schema.YEAR], {})
+                year_counts[key] = year_counts.get(key, 0) + 1
+        return SeedHistory(dict(
+            (year, [list(key) + [games] for (key, games) in sorted(year_counts.items())])
+            for (year, year_counts) in counts.items()
+        ))
+
+
+class SeedHistoryModel:
+    """
+    A probability model (see matchups.py) giving the favorite its seed's
+    historical win rate against the underdog's seed in the round they meet.
+    Rounds a 64 team field does not have, and seeds it does not have, get an
+    even chance.
+
+    :param history: The SeedHistory to take the rates from
+    :param leave_one_out: Whether to leave the bracket's own year out of the
+                          rates, as a fair backtest of that year needs
+    """
+    def __init__(self, history, leave_one_out=True):
+        self.history = history
+        self.leave_one_out = leave_one_out
+
+    def __call__(self, bracket, favorite, underdog):
+        favorite_seed = bracket.seeds[favorite]
+        underdog_seed = bracket.seeds[underdog]
+        round_order = Schema.ROUND_ORDER.get(bracket.round_name((favorite ^ underdog).bit_length()))
+        if round_order is None or max(favorite_seed, underdog_seed) > self.history.max_seed:
+            return 0.5
+        rates = self.history.win_rates(bracket.year if self.leave_one_out else None)
+        return float(rates[round_order, favorite_seed, underdog_seed])
+
+    def __repr__(self):
+        return "SeedHistoryModel(%s)" % ('leave one out' if self.leave_one_out else 'every year')
+
+
+def seed_history_strategies(history, leave_one_out=True):
+    """Strategies picking by seed history, with and without protecting the top seeds"""
+    model = SeedHistoryModel(history, leave_one_out)
+    return [
+        Strategy('Seed History', DefaultStrategies.SEED, None, None, model),
+        Strategy('Seed History w/POW(2) Protection', DefaultStrategies.SEED, None, ExponentialProtection(2), model)
+    ]
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+
+"""
+A long-running local HTTP server for simulations and scoring, so callers do
+not pay for starting Python and parsing the data file on every request.  The
+years are loaded once at startup, the CPU-bound work runs on a process pool
+that receives the brackets once per worker, and results are kept in an LRU
+cache (shared by concurrent requests for the same result).
+
+Every response is JSON:
+
+  GET  /years                                       the years loaded
+  GET  /strategies                                  the strategy names
+  GET  /simulate?year=Y&strategy=NAME[&samples=N|&exact=1]
+                                                    a strategy's predicted bracket, its
+                                                    score and its score distribution
+  POST /score?year=Y  {"picks": [team ids]} or {"mask": "0x..."}
+                                                    a bracket's score, see pool.py
+  GET  /leaderboard[?years=Y,Y][&samples=N|&exact=1]
+                                                    every strategy ranked by its mean score
+  GET  /stats                                       request and cache counters
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import numpy
+
+import montecarlo
+import ncaa_simulations
+import pool
+from ncaa_simulations import INFO, WARN, build_actual_bracket, build_year_mapping_for, evaluate_strategy, load_years, log
+from render import bracket_document
+from seedhistory import SeedHistory, seed_history_strategies
+from strategy import DefaultStrategies
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8642
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_MAX_SAMPLES = 1000000
+MAX_BODY_SIZE = 1 << 20
+
+
+class HTTPError(Exception):
+    """A request that cannot be served, answered with its status and message"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LRUCache:
+    """
+    A mapping holding at most size entries, dropping the least recently used
+    one to make room.
+
+    :param size: The most entries to hold
+    """
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def distribution_summary(distribution):
+    """An ExactScore or ScoreDistribution as a JSON-friendly dictionary"""
+    if distribution is None:
+        return None
+    return {
+        'mean': distribution.mean,
+        'stdev': distribution.stdev,
+        'p5': distribution.percentile(5),
+        'p50': distribution.percentile(50),
+        'p95': distribution.percentile(95),
+        'samples': getattr(distribution, 'samples', None)
+    }
+
+
+_worker_state = None
+
+
+def _initialize_worker(actual_brackets, strategies):
+    global _worker_state
+    ncaa_simulations.LOG_LEVEL = WARN
+    _worker_state = (actual_brackets, strategies)
+
+
+def _simulate_in_worker(year, strategy_index, samples, exact):
+    actual_brackets, strategies = _worker_state
+    actual_bracket = actual_brackets[year]
+    predicted_bracket, distribution = evaluate_strategy(actual_bracket, strategies[strategy_index], year, samples, exact)
+    picks = numpy.asarray(predicted_bracket.winners, dtype=numpy.int16)
+    score = int(montecarlo.score_predictions(picks, actual_bracket, montecarlo.round_weights(actual_bracket)))
+    return predicted_bracket.winners, score, distribution_summary(distribution)
+
+
+class SimulationServer:
+    """
+    Serves the endpoints listed above for a set of actual brackets and
+    strategies.
+
+    :param actual_brackets: Mapping of year to its actual Bracket
+    :param strategies: The strategies that can be simulated
+    :param executor: The process pool running simulations
+    :param cache_size: The most simulation results to keep
+    :param max_samples: The most brackets one request may simulate
+    """
+    def __init__(self, actual_brackets, strategies, executor, cache_size=DEFAULT_CACHE_SIZE, max_samples=DEFAULT_MAX_SAMPLES):
+        self.actual_brackets = actual_brackets
+        self.strategies = strategies
+        self.strategy_indices = dict((strategy.name, index) for (index, strategy) in enumerate(strategies))
+        self.executor = executor
+        self.cache = LRUCache(cache_size)
+        self.max_samples = max_samples
+        self.requests = 0
+        self.routes = {
+            '/years': ('GET', self.years),
+            '/strategies': ('GET', self.strategy_names),
+            '/simulate': ('GET', self.simulate),
+            '/score': ('POST', self.score),
+            '/leaderboard': ('GET', self.leaderboard),
+            '/stats': ('GET', self.stats)
+        }
+
+    async def simulation(self, year, strategy_index, samples, exact):
+        """
+        The predicted winners, score and score distribution of a strategy in a
+        year, from the cache or the process pool.  The pending result is cached
+        straight away, so concurrent requests for it wait on the same run.
+        """
+        key = (year, strategy_index, 0 if exact else samples, exact)
+        result = self.cache.get(key)
+        if result is None:
+            result = asyncio.get_running_loop().run_in_executor(self.executor, _simulate_in_worker, year, strategy_index, samples, exact)
+            self.cache.put(key, result)
+        try:
+            # Shielded so a client hanging up does not cancel the run for everyone else
+            return await asyncio.shield(result)
+        except Exception:
+            self.cache.discard(key)
+            raise
+
+    def score_picks(self, picks, actual_bracket):
+        """The score of each round and in total, and the most still reachable, of one bracket's picks"""
+        current, maximum = pool.score_entries(picks[numpy.newaxis, :], actual_bracket)
+        weights = montecarlo.round_weights(actual_bracket)
+        correct = picks == numpy.asarray(actual_bracket.winners, dtype=numpy.int16)
+        rounds = []
+        for round_index in range(1, actual_bracket.rounds + 1):
+            round_slice = actual_bracket.round_slice(round_index)
+            rounds.append({'round': actual_bracket.round_name(round_index), 'score': int(correct[round_slice] @ weights[round_slice])})
+        return {'score': int(current[0]), 'maximum': int(maximum[0]), 'max_score': actual_bracket.max_score, 'rounds': rounds}
+
+    def years(self, query, body):
+        return {'years': sorted(self.actual_brackets)}
+
+    def strategy_names(self, query, body):
+        return {'strategies': [strategy.name for strategy in self.strategies]}
+
+    async def simulate(self, query, body):
+        year = self.year_of(query)
+        strategy_name = self.parameter(query, 'strategy')
+        if strategy_name not in self.strategy_indices:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Unknown strategy %s" % strategy_name)
+        samples, exact = self.distribution_of(query)
+
+        actual_bracket = self.actual_brackets[year]
+        winners, _, distribution = await self.simulation(year, self.strategy_indices[strategy_name], samples, exact)
+        predicted_bracket = actual_bracket.with_winners(winners)
+        result = {'year': year, 'strategy': strategy_name}
+        result.update(self.score_picks(numpy.asarray(winners, dtype=numpy.int16), actual_bracket))
+        result['distribution'] = distribution
+        result['bracket'] = bracket_document(predicted_bracket, actual_bracket, "%d %s" % (year, strategy_name))
+        return result
+
+    def score(self, query, body):
+        year = self.year_of(query)
+        actual_bracket = self.actual_brackets[year]
+        try:
+            entry = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Expecting a JSON body")
+        if not isinstance(entry, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Expecting a JSON object with picks or a mask")
+
+        try:
+            if 'picks' in entry:
+                teams = actual_bracket.teams
+                if not isinstance(entry['picks'], list) or not all(
+                        isinstance(pick, int) and not isinstance(pick, bool) and 0 <= pick < teams for pick in entry['picks']):
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "Expecting picks as a list of team ids from 0 to %d" % (teams - 1))
+                picks = numpy.array([entry['picks']], dtype=numpy.int16)
+                pool.validate_picks(picks, actual_bracket)
+            elif 'mask' in entry:
+                mask = entry['mask']
+                if isinstance(mask, bool) or not isinstance(mask, (str, int)):
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "Expecting the mask as an integer or a string such as 0x...")
+                picks = pool.decode_masks([int(mask, 0) if isinstance(mask, str) else int(mask)], actual_bracket)
+            else:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Expecting picks or a mask")
+        except (TypeError, OverflowError) as error:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Expecting integer picks or mask: %s" % error)
+        result = {'year': year}
+        result.update(self.score_picks(picks[0], actual_bracket))
+        return result
+
+    async def leaderboard(self, query, body):
+        if 'years' in query:
+            years = [self.checked_year(year) for value in query['years'] for year in value.split(',') if year]
+        else:
+            years = sorted(self.actual_brackets)
+        samples, exact = self.distribution_of(query)
+
+        simulations = await asyncio.gather(*(
+            self.simulation(year, strategy_index, samples, exact)
+            for strategy_index in range(len(self.strategies)) for year in years
+        ))
+        standings = []
+        for strategy_index, strategy in enumerate(self.strategies):
+            scores = []
+            expected_scores = []
+            for _, score, distribution in simulations[strategy_index * len(years):(strategy_index + 1) * len(years)]:
+                scores.append(score)
+                if distribution:
+                    expected_scores.append(distribution['mean'])
+            standings.append({
+                'strategy': strategy.name,
+                'mean': statistics.mean(scores) if scores else None,
+                'min': min(scores) if scores else None,
+                'max': max(scores) if scores else None,
+                'expected_mean': statistics.mean(expected_scores) if expected_scores else None
+            })
+        standings.sort(key=lambda standing: (-(standing['mean'] or 0), standing['strategy']))
+        return {'years': years, 'standings': standings}
+
+    def stats(self, query, body):
+        return {'requests': self.requests, 'cached': len(self.cache), 'hits': self.cache.hits, 'misses': self.cache.misses}
+
+    @staticmethod
+    def parameter(query, name, default=None):
+        if name not in query:
+            if default is None:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Missing parameter %s" % name)
+            return default
+        return query[name][-1]
+
+    def checked_year(self, value):
+        try:
+            year = int(value)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Expecting a year, but found %s" % value)
+        if year not in self.actual_brackets:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Year %d is not loaded" % year)
+        return year
+
+    def year_of(self, query):
+        return self.checked_year(self.parameter(query, 'year'))
+
+    def distribution_of(self, query):
+        """The samples and exact parameters of a request"""
+        exact = self.parameter(query, 'exact', 'false').lower() in ('1', 'true', 'yes')
+        try:
+            samples = int(self.parameter(query, 'samples', '0'))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Expecting a number of samples")
+        if not 0 <= samples <= self.max_samples:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Expecting between 0 and %d samples" % self.max_samples)
+        return samples, exact
+
+    def dispatch(self, method, target):
+        """Finds the handler of a request, returning it with the parsed query"""
+        url = urlsplit(target)
+        if url.path not in self.routes:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Unknown path %s" % url.path)
+        route_method, handler = self.routes[url.path]
+        if method != route_method:
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "Expecting %s for %s" % (route_method, url.path))
+        return handler, parse_qs(url.query)
+
+    async def respond(self, method, target, body):
+        """The status and JSON payload answering one request"""
+        try:
+            handler, query = self.dispatch(method, target)
+            result = handler(query, body)
+            if asyncio.iscoroutine(result):
+                result = await result
+            return HTTPStatus.OK, result
+        except HTTPError as error:
+            return error.status, {'error': str(error)}
+        except ValueError as error:
+            return HTTPStatus.BAD_REQUEST, {'error': str(error)}
+        except Exception as error:
+            log(WARN, "Failed %s %s: %r", method, target, error)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': repr(error)}
+
+    @staticmethod
+    async def read_line(reader):
+        """One line of a request's head, or None if it is longer than the reader's limit"""
+        try:
+            return await reader.readline()
+        except ValueError:
+            return None
+
+    async def handle_connection(self, reader, writer):
+        """Serves the requests of one connection, keeping it open between them unless asked not to"""
+        too_long = {'error': "Request line or header too long"}
+        try:
+            while True:
+                request_line = await self.read_line(reader)
+                if request_line is None:
+                    await self.write_response(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, too_long, False)
+                    break
+                if not request_line.strip():
+                    break
+                start = time.perf_counter()
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.write_response(writer, HTTPStatus.BAD_REQUEST, {'error': "Malformed request line"}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await self.read_line(reader)
+                    if line is None or not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                if line is None:
+                    await self.write_response(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, too_long, False)
+                    break
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+                length = headers.get('content-length', '0') or '0'
+                if not (length.isascii() and length.isdigit()):
+                    await self.write_response(writer, HTTPStatus.BAD_REQUEST, {'error': "Malformed Content-Length"}, False)
+                    break
+                length = int(length)
+                if length > MAX_BODY_SIZE:
+                    await self.write_response(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "Request body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                self.requests += 1
+                status, payload = await self.respond(method, target, body)
+                await self.write_response(writer, status, payload, keep_alive)
+                log(INFO, "%s %s %d %.1fms", method, target, status, 1000 * (time.perf_counter() - start))
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def write_response(writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        writer.write((
+            "HTTP/1.1 %d %s\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Length: %d\r\n"
+            "Connection: %s\r\n"
+            "\r\n" % (status, status.phrase, len(body), 'keep-alive' if keep_alive else 'close')
+        ).encode('latin-1') + body)
+        await writer.drain()
+
+
+def load_brackets(data_file, years=None, use_cache=True):
+    """
+    Builds the actual bracket of every year asked for, or every year of the
+    data file that makes a complete bracket, along with its matchup tables.
+    """
+    if years:
+        loaded_years = load_years(data_file, years, use_cache)
+    else:
+        loaded_years = ((int(year), rows) for (year, rows) in sorted(build_year_mapping_for(data_file, use_cache).items()))
+
+    actual_brackets = {}
+    for year, tournament_games in loaded_years:
+        try:
+            actual_brackets[year] = build_actual_bracket(year, tournament_games)
+        except ValueError as error:
+            if years:
+                raise
+            log(WARN, "Skipping %d: %s", year, error)
+            continue
+        actual_brackets[year].matchups
+    return actual_brackets
+
+
+async def serve(actual_brackets, strategies, host, port, workers, cache_size, max_samples):
+    # Build every model's tables once here, so the workers receive them with the brackets
+    for actual_bracket in actual_brackets.values():
+        for strategy in strategies:
+            if strategy.model:
+                actual_bracket.matchups.probabilities(strategy.model)
+
+    with ProcessPoolExecutor(workers, initializer=_initialize_worker, initargs=(actual_brackets, strategies)) as executor:
+        simulation_server = SimulationServer(actual_brackets, strategies, executor, cache_size, max_samples)
+        server = await asyncio.start_server(simulation_server.handle_connection, host, port)
+        log(INFO, "Serving %d years and %d strategies on http://%s:%d", len(actual_brackets), len(strategies), host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--file", help="The data file to read in", required=True)
+    parser.add_argument("-y", "--years", help="The years to load (every complete year of the data file if not given)", nargs='+', type=int)
+    parser.add_argument("--host", help="The address to listen on", default=DEFAULT_HOST)
+    parser.add_argument("--port", help="The port to listen on", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-w", "--workers", help="The number of processes running simulations", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-c", "--cache-size", help="The most simulation results to keep in memory", type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--max-samples", help="The most brackets a single request may simulate", type=int, default=DEFAULT_MAX_SAMPLES)
+    parser.add_argument("-s", "--seed-history", help="Add the seed history strategies, see ncaa_simulations.py", action="store_true")
+    parser.add_argument("--no-cache", help="Always parse the data file instead of using its binary cache", dest="use_cache", action="store_false")
+    args = parser.parse_args()
+
+    strategies = DefaultStrategies.STRATEGIES
+    if args.seed_history:
+        strategies = strategies + seed_history_strategies(SeedHistory.load(args.file))
+    try:
+        asyncio.run(serve(load_brackets(args.file, args.years, args.use_cache), strategies, args.host, args.port,
+                          args.workers, args.cache_size, args.max_samples))
+    except KeyboardInterrupt:
+        pass
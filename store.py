@@ -0,0 +1,155 @@
+"""
+A local SQLite store of simulation results.  Every (year, strategy) cell of a
+run is keyed by the hash of the data file, the year, the parameters of the
+strategy and how its score distribution was found (the number of samples, or
+exact).  Runs look their cells up before simulating, so reruns skip the cells
+already done and an interrupted sweep picks up from the last year it saved.
+The summary of a run can be recomputed from the store alone.
+"""
+
+import json
+import os
+import sqlite3
+
+from array import array
+
+from datafile import describe_source
+
+STORE_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    data_hash TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    strategy TEXT NOT NULL,
+    samples INTEGER NOT NULL,
+    exact INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    winners BLOB NOT NULL,
+    score INTEGER NOT NULL,
+    mean REAL,
+    distribution TEXT,
+    PRIMARY KEY (data_hash, year, strategy, samples, exact)
+);
+"""
+
+
+class StoredDistribution:
+    """
+    What is kept of a score distribution (an ExactScore or ScoreDistribution):
+    its mean, and how it prints.
+    """
+    def __init__(self, mean, description):
+        self.mean = mean
+        self.description = description
+
+    def __str__(self):
+        return self.description
+
+
+class StoredResult:
+    """A (year, strategy) cell read back from the store"""
+    def __init__(self, winners, score, distribution):
+        self.winners = winners
+        self.score = score
+        self.distribution = distribution
+
+
+def strategy_key(strategy):
+    """
+    The parameters deciding a strategy's results, as a string.  Its name is
+    left out, and its protected function and model are told apart by repr, so
+    ones without a stable repr (such as lambdas) are never found again.
+    """
+    return json.dumps([strategy.seed, strategy.favorite_bias, repr(strategy.protected_function), repr(strategy.model)])
+
+
+def distribution_key(samples, exact):
+    """The (samples, exact) columns of a run, where an exact run has no samples"""
+    return (0, 1) if exact else (samples, 0)
+
+
+class ResultStore:
+    """
+    The results of every run saved to one SQLite file.  Results are written as
+    they come in and only committed with commit(), once per year.
+
+    :param store_filename: The SQLite file, created if it does not exist
+    """
+    def __init__(self, store_filename):
+        self.connection = sqlite3.connect(store_filename)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("PRAGMA user_version = %d" % STORE_VERSION)
+        elif version != STORE_VERSION:
+            raise ValueError("Expecting a version %d result store, but %s is version %d" % (STORE_VERSION, store_filename, version))
+        self.connection.execute("PRAGMA journal_mode = WAL")
+
+    def data_hash(self, data_filename):
+        """
+        The SHA-256 of a data file, only hashing it again if its size or
+        modification time changed since it was last seen.
+        """
+        path = os.path.abspath(data_filename)
+        source = describe_source(data_filename, with_hash=False)
+        row = self.connection.execute("SELECT size, mtime_ns, sha256 FROM sources WHERE path = ?", (path,)).fetchone()
+        if row and (row[0], row[1]) == (source['size'], source['mtime_ns']):
+            return row[2]
+
+        source = describe_source(data_filename)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sources (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                (path, source['size'], source['mtime_ns'], source['sha256'])
+            )
+        return source['sha256']
+
+    def results(self, data_hash, year, strategies, samples=0, exact=False):
+        """
+        The stored results of a year for some strategies.
+
+        :return: Mapping of the index of every strategy with a stored result to
+                 its StoredResult
+        """
+        samples, exact = distribution_key(samples, exact)
+        # Strategies with the same parameters share their stored result
+        indices = {}
+        for index, strategy in enumerate(strategies):
+            indices.setdefault(strategy_key(strategy), []).append(index)
+        rows = self.connection.execute(
+            "SELECT strategy, winners, score, mean, distribution FROM results WHERE data_hash = ? AND year = ? AND samples = ? AND exact = ?",
+            (data_hash, year, samples, exact)
+        )
+
+        stored = {}
+        for key, winners_bytes, score, mean, description in rows:
+            winners = array('h')
+            winners.frombytes(winners_bytes)
+            distribution = None if description is None else StoredDistribution(mean, description)
+            for index in indices.get(key, []):
+                stored[index] = StoredResult(winners, score, distribution)
+        return stored
+
+    def save(self, data_hash, year, strategy, winners, score, distribution, samples=0, exact=False):
+        """Writes one (year, strategy) result, replacing any stored for the same key"""
+        samples, exact = distribution_key(samples, exact)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results (data_hash, year, strategy, samples, exact, name, winners, score, mean, distribution) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (data_hash, year, strategy_key(strategy), samples, exact, strategy.name, array('h', winners).tobytes(), score,
+             None if distribution is None else distribution.mean, None if distribution is None else str(distribution))
+        )
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
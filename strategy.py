@@ -5,22 +5,55 @@ Describes a strategy for picking the winner of a game.
 from schema import Schema
 
 class Strategy:
-
-    def __init__(self, name, seed, favorite_bias, protected_function):
+    """
+    Picks the favorite unless a coin toss lands above favorite_bias, except for
+    the seeds protected_function shields in a round.  With a probability model
+    (see matchups.py) the favorite's chance of being picked comes from the
+    model for every game instead of favorite_bias.
+    """
+    def __init__(self, name, seed, favorite_bias, protected_function, model=None):
         self.name = name
         self.seed = seed
         self.favorite_bias = favorite_bias
         self.protected_function = protected_function
+        self.model = model
+
+class ExponentialProtection:
+    """
+    A protected_function that shields the top seeds from upsets in the early
+    rounds, see DefaultStrategies.exponential_before.  Unlike a lambda it can be
+    pickled, so strategies using it can be sent to worker processes.
+
+    :param base: The base of the exponential
+    :param cutoff: The last round with any protection
+    """
+    def __init__(self, base, cutoff=Schema.SWEET_SIXTEEN):
+        self.base = base
+        self.cutoff = cutoff
+
+    def __call__(self, round):
+        return DefaultStrategies.exponential_before(self.base, self.cutoff, round)
+
+    def __repr__(self):
+        if self.cutoff == Schema.SWEET_SIXTEEN:
+            return "ExponentialProtection(%s)" % self.base
+        return "ExponentialProtection(%s, %r)" % (self.base, self.cutoff)
 
 class DefaultStrategies:
 
     @staticmethod
-    def exponential_before_sweet_sixteen(base, round):
-        if Schema.ROUND_ORDER[round] > Schema.ROUND_ORDER[Schema.SWEET_SIXTEEN]:
+    def exponential_before(base, cutoff, round):
+        # Rounds are counted back from the cutoff, so this works for any field size
+        if Schema.ROUND_TEAMS[round] < Schema.ROUND_TEAMS[cutoff]:
             return 0
-        return pow(base, Schema.ROUND_ORDER[Schema.SWEET_SIXTEEN] - Schema.ROUND_ORDER[round])
+        return pow(base, (Schema.ROUND_TEAMS[round] // Schema.ROUND_TEAMS[cutoff]).bit_length() - 1)
+
+    @staticmethod
+    def exponential_before_sweet_sixteen(base, round):
+        return DefaultStrategies.exponential_before(base, Schema.SWEET_SIXTEEN, round)
 
     __LUCKY_SEED = 0x9272015
+    SEED = __LUCKY_SEED
 
     STRATEGIES = [
         # Simple strategies: all win, all lose, coin toss
@@ -29,8 +62,8 @@ class DefaultStrategies:
         Strategy('Coin Toss', __LUCKY_SEED, 0.5, None),
 
         # Complex, during each round protect a set of "chosen ones"
-        Strategy('50/50 w/POW(2) Protection', __LUCKY_SEED, 0.5, lambda round: DefaultStrategies.exponential_before_sweet_sixteen(2, round)),
-        Strategy('75% w/POW(2) Protection', __LUCKY_SEED, 0.75, lambda round: DefaultStrategies.exponential_before_sweet_sixteen(2, round)),
-        Strategy('50/50 w/POW(3) Protection', __LUCKY_SEED, 0.5, lambda round: DefaultStrategies.exponential_before_sweet_sixteen(3, round)),
-        Strategy('75% w/POW(3) Protection', __LUCKY_SEED, 0.75, lambda round: DefaultStrategies.exponential_before_sweet_sixteen(3, round))
+        Strategy('50/50 w/POW(2) Protection', __LUCKY_SEED, 0.5, ExponentialProtection(2)),
+        Strategy('75% w/POW(2) Protection', __LUCKY_SEED, 0.75, ExponentialProtection(2)),
+        Strategy('50/50 w/POW(3) Protection', __LUCKY_SEED, 0.5, ExponentialProtection(3)),
+        Strategy('75% w/POW(3) Protection', __LUCKY_SEED, 0.75, ExponentialProtection(3))
     ]
@@ -0,0 +1,88 @@
+"""
+Counters and timers for the phases of a simulation run (loading the data file,
+building the actual bracket, copying, predicting, scoring and printing it, and
+storing the results), kept per year and per strategy.
+"""
+
+import time
+
+from contextlib import contextmanager
+
+PHASES = ['load', 'build', 'copy', 'predict', 'distribution', 'score', 'render', 'store']
+
+
+class PhaseTimer:
+    """
+    Accumulates the number of calls and the time spent in every phase, keyed
+    by (phase, year, strategy name).  Years and strategies are None for phases
+    that do not depend on them.
+    """
+    def __init__(self, totals=None):
+        self.totals = totals if totals is not None else {}
+
+    def record(self, phase, seconds, year=None, strategy=None):
+        key = (phase, year, strategy)
+        calls, total_seconds = self.totals.get(key, (0, 0.0))
+        self.totals[key] = (calls + 1, total_seconds + seconds)
+
+    @contextmanager
+    def phase(self, phase, year=None, strategy=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start, year, strategy)
+
+    def merge(self, totals):
+        """Adds the totals of another timer (e.g. from a worker process)"""
+        for key, (calls, seconds) in totals.items():
+            total_calls, total_seconds = self.totals.get(key, (0, 0.0))
+            self.totals[key] = (total_calls + calls, total_seconds + seconds)
+
+    def by(self, position):
+        """
+        Sums the totals over everything but the phase and one other part of
+        the key (1 for years, 2 for strategies), e.g. {('predict', 2015): (7, 0.01)}
+        """
+        summed = {}
+        for key, (calls, seconds) in self.totals.items():
+            summed_key = (key[0], key[position])
+            total_calls, total_seconds = summed.get(summed_key, (0, 0.0))
+            summed[summed_key] = (total_calls + calls, total_seconds + seconds)
+        return summed
+
+    def phase_totals(self):
+        return dict((phase, totals) for ((phase, _), totals) in self.by(0).items())
+
+    def report(self):
+        """The totals as lines of text: per phase, then per phase and year, then per phase and strategy"""
+        lines = ["%s %10s %12s %12s" % ('PHASE'.ljust(14), 'CALLS', 'SECONDS', 'MEAN (ms)')]
+        phase_totals = self.phase_totals()
+        for phase in sorted(phase_totals, key=_phase_order):
+            calls, seconds = phase_totals[phase]
+            lines.append("%s %10d %12.4f %12.4f" % (phase.ljust(14), calls, seconds, 1000 * seconds / calls))
+
+        for title, position in (('YEAR', 1), ('STRATEGY', 2)):
+            lines.append("")
+            lines.append("%s %s %10s %12s" % ('PHASE'.ljust(14), title.ljust(40), 'CALLS', 'SECONDS'))
+            totals = self.by(position)
+            for phase, part in sorted((key for key in totals if key[1] is not None), key=lambda key: (_phase_order(key[0]), str(key[1]))):
+                calls, seconds = totals[(phase, part)]
+                lines.append("%s %s %10d %12.4f" % (phase.ljust(14), str(part).ljust(40), calls, seconds))
+        return lines
+
+    def to_json(self):
+        """The totals as a list of JSON-friendly records"""
+        return [
+            {'phase': phase, 'year': year, 'strategy': strategy, 'calls': calls, 'seconds': seconds}
+            for ((phase, year, strategy), (calls, seconds)) in sorted(self.totals.items(), key=lambda item: _sort_key(item[0]))
+        ]
+
+
+def _phase_order(phase):
+    return PHASES.index(phase) if phase in PHASES else len(PHASES)
+
+
+def _sort_key(key):
+    phase, year, strategy = key
+    return (_phase_order(phase), phase, year or 0, strategy or '')